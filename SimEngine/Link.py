@@ -5,12 +5,13 @@ its behaviour
 
 class Link(object):
     def __init__(self,node,timesToschedule, id):
-        self.compartibleLinks = []
         self.sendNode=node[0]
         self.rcvNode = node[1]
+        self.nodes = (1<<self.sendNode)|(1<<self.rcvNode) #bitset of its two nodes, by id
         self.timesToSchedule=timesToschedule
         self.isScheduled = False
         self.timesScheduledAlready =0
+        self.earliestTimeSlot =0 #no timeslot before this one can take the link (see Scheduler.schedule)
         self.packetsToCarry=timesToschedule
         self.id = id
 
@@ -25,12 +26,9 @@ class Link(object):
             return False
         else:
             return True
-    def addCompartibleLink(self,link):
-        self.compartibleLinks.append(link)
     def isCompartible(self,link):
-        return any(l == link for l in self.compartibleLinks);
-        #if the link is not found in the set.
-        return False;
+        #links can share a timeslot if they have no node in common
+        return (self.nodes & link.nodes)==0
     def sharesNode(self,link):
         return (self.sendNode==link.sendNode or self.rcvNode==link.rcvNode or self.rcvNode==link.sendNode or self.sendNode==link.rcvNode)
     def getLinkInfo(self):
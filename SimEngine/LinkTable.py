@@ -0,0 +1,78 @@
+#!/usr/bin/python
+'''
+\brief Compact table of the links of one mote.
+
+Used instead of the per-mote RSSI, PDR and DISTANCE dicts when the topology
+only keeps the links within a cutoff (see Topology). The neighbors are kept
+sorted by id in typed arrays; a mote missing from the table has no link and
+does not interfere.
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('LinkTable')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ imports =========================================
+
+import array
+import bisect
+
+#============================ defines =========================================
+
+NO_LINK_RSSI     = float('-inf') # dBm
+NO_LINK_PDR      = 0.0
+NO_LINK_DISTANCE = float('inf')
+
+#============================ body ============================================
+
+class LinkTable(object):
+
+    def __init__(self,ids,rssi,pdr,distance):
+        '''
+        \param ids      Ids of the neighbors, in increasing order.
+        \param rssi     RSSI to each of them (dBm).
+        \param pdr      PDR to each of them.
+        \param distance Distance to each of them.
+        '''
+        self.ids         = array.array('i',ids)
+        self.rssi        = array.array('d',rssi)
+        self.pdr         = array.array('d',pdr)
+        self.distance    = array.array('d',distance)
+
+    def __len__(self):
+        return len(self.ids)
+
+    #======================== public ==========================================
+
+    def getRSSI(self,neighborId):
+        i = self._find(neighborId)
+        return NO_LINK_RSSI if i is None else self.rssi[i]
+
+    def getPDR(self,neighborId):
+        i = self._find(neighborId)
+        return NO_LINK_PDR if i is None else self.pdr[i]
+
+    def getDistance(self,neighborId):
+        i = self._find(neighborId)
+        return NO_LINK_DISTANCE if i is None else self.distance[i]
+
+    def hasLink(self,neighborId):
+        return self._find(neighborId) is not None
+
+    def getRSSIs(self):
+        ''' (neighbor id, RSSI) of every link '''
+        return zip(self.ids,self.rssi)
+
+    #======================== private =========================================
+
+    def _find(self,neighborId):
+        i = bisect.bisect_left(self.ids,neighborId)
+        if i<len(self.ids) and self.ids[i]==neighborId:
+            return i
+        return None
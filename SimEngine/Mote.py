@@ -22,18 +22,42 @@ log.addHandler(NullHandler())
 
 import copy
 import random
-import threading
 import math
 import os
-import SimEngine
-import SimSettings
-import Propagation
 import Topology
 
 from MoteTimer import MoteTimer
 
 #============================ defines =========================================
 
+#============================ helpers =========================================
+
+def _restoreMote(id):
+    mote    = Mote.__new__(Mote)
+    mote.id = id
+    return mote
+
+class TxHistory(object):
+    '''
+    Outcome (1 for ACK, 0 otherwise) of the last transmissions in a cell,
+    kept in a ring buffer with a running count and sum.
+    '''
+
+    def __init__(self,size):
+        self.outcomes    = [0]*size
+        self.next        = 0   # index the next outcome is written at
+        self.numTx       = 0   # number of outcomes in the buffer
+        self.numTxAck    = 0   # number of ACKed ones among them
+
+    def add(self,outcome):
+        if self.numTx==len(self.outcomes):
+            self.numTxAck             -= self.outcomes[self.next]
+        else:
+            self.numTx                += 1
+        self.outcomes[self.next]       = outcome
+        self.numTxAck                 += outcome
+        self.next                      = (self.next+1)%len(self.outcomes)
+
 #============================ body ============================================
 
 class Mote(object):
@@ -82,18 +106,18 @@ class Mote(object):
     CHARGE_RxDataTxAck_uC              = 76.90
     CHARGE_RxData_uC                   = 64.65
     slotFrameSize                      =101
-    def __init__(self,id):
+    def __init__(self,id,context):
         #logus()
 
         # store params
         self.id                        = id
         # local variables
-        self.dataLock                  = threading.RLock()
+        self.engine                    = context.engine
+        self.settings                  = context.settings
+        self.dataLock                  = self.engine.newLock()
         self.state                     = 0
-
-        self.engine                    = SimEngine.SimEngine()
-        self.settings                  = SimSettings.SimSettings()
-        self.propagation               = Propagation.Propagation()
+        self.propagation               = context.propagation
+        self.scheduleIndex             = context.scheduleIndex
         self.filename                  ="../bin/simData/mote_"+str(self.id)+".csv"
         self.outputfile                = open(self.filename,"w")
         self.timeslot                  = None
@@ -112,7 +136,7 @@ class Mote(object):
         self.neighborRank              = {}                    # indexed by neighbor
         self.neighborDagRank           = {}                    # indexed by neighbor
         self.trafficPortionPerParent   = {}                    # indexed by parent, portion of outgoing traffic
-        self.loggedSchedule            = {}
+        self.loggedSchedule            = []
         # otf
         self.asnOTFevent               = None
         self.otfHousekeepingPeriod     = self.settings.otfHousekeepingPeriod
@@ -144,7 +168,10 @@ class Mote(object):
         self.RSSI                      = {}                    # indexed by neighbor
         self.PDR                       = {}                    # indexed by neighbor
         self.DISTANCE                  = {}
-        self.packetsTosend             =1
+        self.links                     = None                  # LinkTable replacing the 3 dicts above, when links are cut off
+        self.neighbors                 = None                  # cached by _myNeigbors, reset by Topology when motes move
+        self.packetsTosend             = None                  # packets sent per slotframe, see measurePacketsToSend (None until measured)
+        self.packetsOffered            = 0                     # packets given to _tsch_enqueue since the last measurement
         self.packetStructure      = []
         self.idleTimes                 =0
         # location
@@ -172,6 +199,20 @@ class Mote(object):
         self.topology_tag=None
         self.mote_log=""
         self.combinedCellList=[]
+
+    def __hash__(self):
+        # motes key many dicts; hashing by id keeps their order, and hence
+        # the simulation results, independent of where motes sit in memory
+        return self.id
+
+    def __reduce__(self):
+        # locks, open files, timers and GUI items are not saved in a
+        # checkpoint; the id is restored first since it is the hash
+        state = self.__dict__.copy()
+        for k in ['dataLock','outputfile','timer','topology','topology_tag']:
+            state[k] = None
+        return (_restoreMote,(self.id,),state)
+
     #======================== stack ===========================================
 
     #===== role
@@ -293,7 +334,6 @@ class Mote(object):
         with self.dataLock:
 
             if self.rank!=None and self.dagRank!=None:
-                self.packetsTosend=1
                 #self.state = 2
 
                 # update mote stats
@@ -352,8 +392,8 @@ class Mote(object):
                     # record this potential rank
                     potentialRanks[neighbor] = neighborRank+rankIncrease
 
-            # sort potential ranks
-            sorted_potentialRanks = sorted(potentialRanks.iteritems(), key=lambda x:x[1])
+            # sort potential ranks, equal ones by id (the order of the dict is not kept by a checkpoint)
+            sorted_potentialRanks = sorted(potentialRanks.iteritems(), key=lambda x:(x[1],x[0].id))
 
             # switch parents only when rank difference is large enough
             for i in range(1,len(sorted_potentialRanks)):
@@ -416,7 +456,7 @@ class Mote(object):
                 #get the neighbor with the minimum rank
 
                 #print "neighbors list {0}-{1}, mote-rank = {2}".format(self.id, [(n.id, n.getMoteRank()) for n in self._myNeigbors()], self.getMoteRank())
-                self.parentSet = [sorted(self._myNeigbors(), key=lambda mote: mote.getMoteRank())[0]]
+                self.parentSet = [self.engine.topology.getRoutingTree().getParent(self)]
 
 
 
@@ -436,7 +476,7 @@ class Mote(object):
             self.trafficPortionPerParent = dict([(p, etxs[p]/sumEtxs) for p in self.parentSet])
 
             # remove TX cells to neighbor who are not in parent set
-            for neighbor in self.numCellsToNeighbors.keys():
+            for neighbor in sorted(self.numCellsToNeighbors.keys(),key=lambda m: m.id):
                 if neighbor not in self.parentSet:
                     # log
                     self._log(
@@ -445,12 +485,9 @@ class Mote(object):
                         (neighbor.id,[p.id for p in self.parentSet]),
                     )
 
-                    tsList=[ts for ts, cell in self.schedule.iteritems() if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX]
+                    tsList=[ts for ts, cell in sorted(self.schedule.iteritems()) if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX]
                     self._sixtop_cell_deletion_sender(neighbor,tsList)
 
-    def _increasePacketsToSend(self, increment):
-        self.packetsTosend=self.packetsTosend+increment
-
 
     def _rpl_calcRankIncrease(self, neighbor):
 
@@ -490,7 +527,7 @@ class Mote(object):
             rxNeighbors = [cell['neighbor'] for (ts,cell) in self.schedule.items() if cell['dir']==self.DIR_RX]
 
             # remove duplicates
-            rxNeighbors = list(set(rxNeighbors))
+            rxNeighbors = sorted(set(rxNeighbors),key=lambda m: m.id)
 
             # reset inTrafficMovingAve
             neighbors = self.inTrafficMovingAve.keys()
@@ -514,7 +551,7 @@ class Mote(object):
             # calculate my total generated traffic, in pkt/s
             genTraffic       = 0
             # generated/relayed by me
-            for neighborOrMe in self.inTrafficMovingAve:
+            for neighborOrMe in sorted(self.inTrafficMovingAve,key=lambda m: m.id):
                 genTraffic  += self.inTrafficMovingAve[neighborOrMe]/self.otfHousekeepingPeriod
             # convert to pkts/cycle
             genTraffic      *= self.settings.slotframeLength*self.settings.slotDuration
@@ -653,8 +690,8 @@ class Mote(object):
         # collect all neighbors I have TX cells to
         txNeighbors = [cell['neighbor'] for (ts,cell) in self.schedule.items() if cell['dir']==self.DIR_TX]
 
-        # remove duplicates
-        txNeighbors = list(set(txNeighbors))
+        # remove duplicates, by id (the order of the schedule is not kept by a checkpoint)
+        txNeighbors = sorted(set(txNeighbors),key=lambda m: m.id)
 
         for neighbor in txNeighbors:
             nowCells = self.numCellsToNeighbors.get(neighbor,0)
@@ -669,8 +706,8 @@ class Mote(object):
         # collect neighbors from which I have RX cells that is detected as collision cell
         rxNeighbors = [cell['neighbor'] for (ts,cell) in self.schedule.items() if cell['dir']==self.DIR_RX and cell['rxDetectedCollision']]
 
-        # remove duplicates
-        rxNeighbors = list(set(rxNeighbors))
+        # remove duplicates, by id
+        rxNeighbors = sorted(set(rxNeighbors),key=lambda m: m.id)
 
         for neighbor in rxNeighbors:
             nowCells = self.numCellsFromNeighbors.get(neighbor,0)
@@ -693,7 +730,7 @@ class Mote(object):
 
         # pdr for each cell
         cell_pdr = []
-        for (ts,cell) in self.schedule.items():
+        for (ts,cell) in sorted(self.schedule.items()):
             if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX:
                 # this is a TX cell to that neighbor
 
@@ -702,15 +739,15 @@ class Mote(object):
                     continue
 
                 # calculate pdr for that cell
-                recentHistory = cell['history'][-self.NUM_MAX_HISTORY:]
-                pdr = float(sum(recentHistory)) / float(len(recentHistory))
+                recentHistory = cell['history']
+                pdr = float(recentHistory.numTxAck) / float(recentHistory.numTx)
 
                 # store result
                 cell_pdr += [(ts,pdr)]
 
         # pdr for the bundle as a whole
-        bundleNumTx     = sum([len(cell['history'][-self.NUM_MAX_HISTORY:]) for cell in self.schedule.values() if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX])
-        bundleNumTxAck  = sum([sum(cell['history'][-self.NUM_MAX_HISTORY:]) for cell in self.schedule.values() if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX])
+        bundleNumTx     = sum([cell['history'].numTx for cell in self.schedule.values() if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX])
+        bundleNumTxAck  = sum([cell['history'].numTxAck for cell in self.schedule.values() if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX])
         if bundleNumTx<self.NUM_SUFFICIENT_TX:
             bundlePdr   = None
         else:
@@ -739,8 +776,8 @@ class Mote(object):
             assert worst_pdr!=None
 
             # ave pdr for other cells
-            othersNumTx      = sum([len(cell['history'][-self.NUM_MAX_HISTORY:]) for (ts,cell) in self.schedule.items() if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX and ts != worst_ts])
-            othersNumTxAck   = sum([sum(cell['history'][-self.NUM_MAX_HISTORY:]) for (ts,cell) in self.schedule.items() if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX and ts != worst_ts])
+            othersNumTx      = sum([cell['history'].numTx for (ts,cell) in self.schedule.items() if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX and ts != worst_ts])
+            othersNumTxAck   = sum([cell['history'].numTxAck for (ts,cell) in self.schedule.items() if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX and ts != worst_ts])
             if othersNumTx<self.NUM_SUFFICIENT_TX:
                 ave_pdr      = None
             else:
@@ -821,7 +858,7 @@ class Mote(object):
         from a neighbor it did not expect ('rxDetectedCollision')
         '''
 
-        rxCells = [(ts,cell) for (ts,cell) in self.schedule.items() if cell['dir']==self.DIR_RX and cell['rxDetectedCollision'] and cell['neighbor']==neighbor]
+        rxCells = [(ts,cell) for (ts,cell) in sorted(self.schedule.items()) if cell['dir']==self.DIR_RX and cell['rxDetectedCollision'] and cell['neighbor']==neighbor]
 
         relocation = False
         for ts,cell in rxCells:
@@ -946,6 +983,11 @@ class Mote(object):
 
     def _sixtop_cell_deletion_receiver(self,neighbor,tsList):
         with self.dataLock:
+            # cells of the centralized schedule can be reserved again later
+            for ts in tsList:
+                cell = (ts,self.DIR_RX,neighbor.id,self.schedule[ts]['ch'])
+                if cell in self.loggedSchedule:
+                    self.combinedCellList.append(cell)
             self._tsch_removeCells(
                 neighbor     = neighbor,
                 tsList       = tsList,
@@ -961,8 +1003,9 @@ class Mote(object):
         # get cells to the neighbors
         scheduleList = []
 
-        # worst cell removing initialized by theoretical pdr
-        for (ts,cell) in self.schedule.iteritems():
+        # worst cell removing initialized by theoretical pdr; by timeslot, as the
+        # order of the schedule dict is not kept by a checkpoint
+        for (ts,cell) in sorted(self.schedule.iteritems()):
             if cell['neighbor']==neighbor and cell['dir']==self.DIR_TX:
                 cellPDR           = (float(cell['numTxAck'])+(self.getPDR(neighbor)*self.NUM_SUFFICIENT_TX))/(cell['numTx']+self.NUM_SUFFICIENT_TX)
                 scheduleList     += [(ts,cell['numTxAck'],cell['numTx'],cellPDR)]
@@ -1006,6 +1049,8 @@ class Mote(object):
 
     def _tsch_enqueue(self,packet):
 
+        self.packetsOffered += 1
+
         if not self.preferredParent:
             # I don't have a route
             #print "Packete Dropped due to Parent"
@@ -1161,13 +1206,17 @@ class Mote(object):
                     'numTx':                     0,
                     'numTxAck':                  0,
                     'numRx':                     0,
-                    'history':                   [],
+                    'history':                   TxHistory(self.NUM_MAX_HISTORY),
                     'rxDetectedCollision':       False,
-                    'debug_canbeInterfered':     [],                      # [debug] shows schedule collision that can be interfered with minRssi or larger level
-                    'debug_interference':        [],                      # [debug] shows an interference packet with minRssi or larger level
-                    'debug_lockInterference':    [],                      # [debug] shows locking on the interference packet
-                    'debug_cellCreatedAsn':      self.engine.getAsn(),    # [debug]
                 }
+              self.scheduleIndex.addCell(self,cell[0],cell[1],cell[2])
+              if self.settings.debugCells:
+                  self.schedule[cell[0]].update({
+                    'debug_canbeInterfered':     0,                       # [debug] num. of TX in a schedule collision that can be interfered with minRssi or larger level
+                    'debug_interference':        0,                       # [debug] num. of TX with an interference packet with minRssi or larger level
+                    'debug_lockInterference':    0,                       # [debug] num. of TX the receiver locked on the interference packet
+                    'debug_cellCreatedAsn':      self.engine.getAsn(),    # [debug]
+                  })
                 # log
               self._log(
                     self.INFO,
@@ -1189,7 +1238,8 @@ class Mote(object):
             for ts in tsList:
                 assert ts in self.schedule.keys()
                 assert self.schedule[ts]['neighbor']==neighbor
-                self.schedule.pop(ts)
+                cell = self.schedule.pop(ts)
+                self.scheduleIndex.removeCell(self,ts,cell['ch'],cell['dir'])
             self._tsch_schedule_activeCell()
 
     #===== radio
@@ -1216,7 +1266,7 @@ class Mote(object):
                 self.schedule[ts]['numTxAck'] += 1
 
                 # update history
-                self.schedule[ts]['history'] += [1]
+                self.schedule[ts]['history'].add(1)
 
                 # update queue stats
                 self._stats_logQueueDelay(asn-self.pktToSend['asn'])
@@ -1239,7 +1289,7 @@ class Mote(object):
                 self.schedule[ts]['numTxAck'] += 1
 
                 # update history
-                self.schedule[ts]['history'] += [1]
+                self.schedule[ts]['history'].add(1)
 
                 # time correction
                 if self.schedule[ts]['neighbor'] == self.preferredParent:
@@ -1265,7 +1315,7 @@ class Mote(object):
                 # neither ACK nor NACK received
                 #print "i am non of the above"
                 # update history
-                self.schedule[ts]['history'] += [0]
+                self.schedule[ts]['history'].add(0)
 
                 # decrement 'retriesLeft' counter associated with that packet
                 i = self.txQueue.index(self.pktToSend)
@@ -1290,16 +1340,12 @@ class Mote(object):
             self.waitingFor = None
 
             # for debug
-            ch = self.schedule[ts]['ch']
-            rx = self.schedule[ts]['neighbor']
-            canbeInterfered = 0
-            for mote in self.engine.motes:
-                if mote == self:
-                    continue
-                if ts in mote.schedule and ch == mote.schedule[ts]['ch'] and mote.schedule[ts]['dir'] == self.DIR_TX:
-                    if mote.getRSSI(rx)>rx.minRssi:
-                        canbeInterfered = 1
-            self.schedule[ts]['debug_canbeInterfered'] += [canbeInterfered]
+            if self.settings.debugCells:
+                ch = self.schedule[ts]['ch']
+                rx = self.schedule[ts]['neighbor']
+                others = self.scheduleIndex.getTransmitters(ts,ch)-set([self])
+                if others & self.propagation.canInterfere[rx]:
+                    self.schedule[ts]['debug_canbeInterfered'] += 1
 
     def radio_rxDone(self,type=None,smac=None,dmac=None,payload=None):
         '''end of RX radio activity'''
@@ -1399,6 +1445,8 @@ class Mote(object):
     def getPDR(self,neighbor):
         ''' returns the pdr to that neighbor'''
         with self.dataLock:
+            if self.links is not None:
+                return self.links.getPDR(neighbor.id)
             return self.PDR[neighbor]
 
     def setDistance(self,neighbor,pdr):
@@ -1409,6 +1457,8 @@ class Mote(object):
     def getDistance(self,neighbor):
         ''' returns the pdr to that neighbor'''
         with self.dataLock:
+            if self.links is not None:
+                return self.links.getDistance(neighbor.id)
             return self.DISTANCE[neighbor]
 
     def setRSSI(self,neighbor,rssi):
@@ -1419,12 +1469,32 @@ class Mote(object):
     def getRSSI(self,neighbor):
         ''' returns the RSSI to that neighbor'''
         with self.dataLock:
+            if self.links is not None:
+                return self.links.getRSSI(neighbor.id)
             return self.RSSI[neighbor.id]
 
+    def getRSSIs(self):
+        ''' returns the (neighbor id, RSSI) of all links'''
+        with self.dataLock:
+            if self.links is not None:
+                return self.links.getRSSIs()
+            return self.RSSI.items()
+
+    def hasLink(self,neighbor):
+        ''' returns whether there is a link to that neighbor'''
+        with self.dataLock:
+            if self.links is not None:
+                return self.links.hasLink(neighbor.id)
+            return neighbor.id in self.RSSI
+
     def setMoteRank(self,moterank):
         '''returns the rank of the mote'''
         with self.dataLock:
+            changed = moterank!=self.mote_rank
             self.mote_rank = moterank
+        # the routing tree picks parents by this rank
+        if changed:
+            self.engine.topology.resetRoutingTree()
 
     def getMoteRank(self):
         with self.dataLock:
@@ -1454,7 +1524,10 @@ class Mote(object):
             return etx
 
     def _myNeigbors(self):
-        return [n for n in self.DISTANCE.keys() if self.DISTANCE[n]< 100]
+        ''' motes within Topology.NEIGHBOR_DISTANCE, by id (do not modify the returned list) '''
+        if self.neighbors is None:
+            self.neighbors = self.engine.topology.getNeighbors(self)
+        return self.neighbors
     #===== clock
 
     def clock_getOffsetToDagRoot(self):
@@ -1722,12 +1795,52 @@ class Mote(object):
         self.assignedTimeslots=[]
         for cell in schedule:
             self.assignedTimeslots.append(cell[0])
-        self.combinedCellList=schedule
-        self.loggedSchedule = schedule
+        self.combinedCellList=list(schedule)
+        self.loggedSchedule = list(schedule)
         self.engine.scheduler.slotFrameSize=self.settings.slotframeLength
 
+    def updateSchedule(self,addedCells,removedCells):
+        ''' apply the changes of a rescheduling, cells are given as in assignSchedule '''
+        with self.dataLock:
+            for cell in removedCells:
+                (ts,dir,neighborId,ch) = cell
+                self.assignedTimeslots.remove(ts)
+                self.loggedSchedule.remove(cell)
+                if cell in self.combinedCellList:
+                    self.combinedCellList.remove(cell)
+                if ts in self.schedule and self.schedule[ts]['dir']==dir and self.schedule[ts]['neighbor'].id==neighborId:
+                    neighbor = self.schedule[ts]['neighbor']
+                    self._tsch_removeCells(neighbor,[ts])
+                    if dir==self.DIR_TX:
+                        self.numCellsToNeighbors[neighbor]   -= 1
+                    else:
+                        self.numCellsFromNeighbors[neighbor] -= 1
+            for cell in addedCells:
+                self.assignedTimeslots.append(cell[0])
+                self.loggedSchedule.append(cell)
+                self.combinedCellList.append(cell)
+
 
 
+    def measurePacketsToSend(self,numSlotframes):
+        '''
+        \brief Measure the packets the mote sends per slotframe, for the centralized scheduler.
+
+        These are the packets given to the TSCH queue (its own and relayed) over
+        the last numSlotframes slotframes, each counted as many times as it is
+        expected to be transmitted to the parent (ETX, MAX ETX while unknown).
+        '''
+        with self.dataLock:
+            packets = float(self.packetsOffered)/numSlotframes
+            if self.parentSet and self.parentSet[0]:
+                etx = self._estimateETX(self.parentSet[0])
+                if not etx or etx>self.RPL_MAX_ETX:
+                    etx = self.RPL_MAX_ETX
+                packets *= etx
+            self.packetsTosend  = max(1,int(math.ceil(packets)))
+            self.packetsOffered = 0
+            return self.packetsTosend
+
     def updateTimeSlot(self):
         if self.engine.scheduler.slotFrameSize != 0:
             self.timeslot=self.engine.getAsn()%self.settings.slotframeLength
@@ -20,13 +20,15 @@ log.addHandler(NullHandler())
 
 #============================ imports =========================================
 
-import threading
 import random
 import math
 
+try:
+    import numpy
+except ImportError:
+    numpy = None # only needed by VectorPropagation
+
 import Topology
-import SimSettings
-import SimEngine
 
 #============================ defines =========================================
 
@@ -34,64 +36,71 @@ import SimEngine
 
 class Propagation(object):
 
-    #===== start singleton
-    _instance      = None
-    _init          = False
-
-    def __new__(cls, *args, **kwargs):
-        if not cls._instance:
-            cls._instance = super(Propagation,cls).__new__(cls, *args, **kwargs)
-        return cls._instance
-    #===== end singleton
-
-    def __init__(self):
-
-        #===== start singleton
-        # don't re-initialize an instance (needed because singleton)
-        if self._init:
-            return
-        self._init = True
-        #===== end singleton
+    def __init__(self,context):
 
         # store params
-        self.settings                  = SimSettings.SimSettings()
-        self.engine                    = SimEngine.SimEngine()
+        self.settings                  = context.settings
+        self.engine                    = context.engine
 
         # variables
-        self.dataLock                  = threading.Lock()
+        self.dataLock                  = self.engine.newLock(reentrant=False)
         self.receivers                 = [] # motes with radios currently listening
+        self.listening                 = {} # receivers indexed by channel, then by mote
         self.transmissions             = [] # ongoing transmissions
+        self.transmissionsByChannel    = {} # ongoing transmissions indexed by channel
+        self.propagateAsn              = None # ASN at which propagation is scheduled
+        self.canInterfere              = {}   # per mote, the motes it hears above its minRssi
 
-        # schedule propagation task
-        self._schedule_propagate()
-
-    def destroy(self):
-        self._instance                 = None
-        self._init                     = False
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['dataLock'] = None
+        return state
 
     #======================== public ==========================================
 
+    #===== topology
+
+    def loadTopology(self):
+        '''
+        Precompute, for each mote, the set of motes it hears above its minRssi.
+        RSSIs are static (and symmetric) once Topology.createTopology has run,
+        so any signal of a mote outside that set is never an effective
+        interference.
+        '''
+        with self.dataLock:
+            motesById                  = dict((m.id,m) for m in self.engine.motes)
+            self.canInterfere          = {}
+            for mote in self.engine.motes:
+                self.canInterfere[mote] = set(
+                    motesById[neighborId] for (neighborId,rssi) in mote.getRSSIs() if rssi>mote.minRssi
+                )
+
     #===== communication
 
     def startRx(self,mote,channel):
         ''' add a mote as listener on a channel'''
         with self.dataLock:
-            self.receivers += [{
+            receiver = {
                 'mote':                mote,
                 'channel':             channel,
-            }]
+            }
+            self.receivers += [receiver]
+            self.listening.setdefault(channel,{})[mote] = receiver
+            self._schedule_propagate()
 
     def startTx(self,channel,type,smac,dmac,payload):
         ''' add a mote as using a channel for tx'''
         with self.dataLock:
-            self.transmissions  += [{
+            transmission = {
                 'channel':             channel,
                 'type':                type,
                 'smac':                smac,
                 'dmac':                dmac,
                 'payload':             payload,
-            }]
-
+            }
+            self.transmissions += [transmission]
+            self.transmissionsByChannel.setdefault(channel,[]).append(transmission)
+            self._schedule_propagate()
 
     def propagate(self):
         ''' Simulate the propagation of pkts in a slot. '''
@@ -108,159 +117,132 @@ class Propagation(object):
                 arrivalTime[transmission['smac']] = transmission['smac'].clock_getOffsetToDagRoot()
 
             for transmission in self.transmissions:
-                i           = 0 # index of a receiver
                 isACKed     = False
                 isNACKed    = False
 
-                while i<len(self.receivers):
-
-                    if self.receivers[i]['channel']==transmission['channel']:
-                        # this receiver is listening on the right channel
+                # the destination, if it listens on this channel and has not received yet
+                receiver    = self.listening.get(transmission['channel'],{}).pop(transmission['dmac'],None)
 
-                        if self.receivers[i]['mote']==transmission['dmac']:
-                            # this packet is destined for this mote
+                if receiver:
+                    # this packet is destined for this mote
 
-                            if not self.settings.noInterference:
+                    if not self.settings.noInterference:
 
-                                #================ with interference ===========
+                        #================ with interference ===========
 
-                                # other transmissions on the same channel?
-                                interferers = [t['smac'] for t in self.transmissions if (t!=transmission) and (t['channel']==transmission['channel'])]
+                        # other transmissions on the same channel?
+                        interferers = [t['smac'] for t in self.transmissionsByChannel[transmission['channel']] if t is not transmission]
+                        audible     = self.canInterfere[transmission['dmac']].intersection(interferers)
 
-                                interferenceFlag = 0
-                                for itfr in interferers:
-                                    if transmission['dmac'].getRSSI(itfr)>transmission['dmac'].minRssi:
-                                        interferenceFlag = 1
+                        interferenceFlag = 1 if audible else 0
 
-                                transmission['smac'].schedule[ts]['debug_interference'] += [interferenceFlag] # debug only
+                        if self.settings.debugCells:
+                            transmission['smac'].schedule[ts]['debug_interference'] += interferenceFlag # debug only
 
-                                if interferenceFlag:
-                                    transmission['smac'].stats_incrementRadioStats('probableCollisions')
+                        if interferenceFlag:
+                            transmission['smac'].stats_incrementRadioStats('probableCollisions')
 
-                                lockOn = transmission['smac']
-                                for itfr in interferers:
-                                    if arrivalTime[itfr] < arrivalTime[lockOn] and transmission['dmac'].getRSSI(itfr)>transmission['dmac'].minRssi:
-                                        # lock on interference
-                                        lockOn = itfr
-
-                                if lockOn == transmission['smac']:
-                                    # mote locked in the current signal
-
-                                    transmission['smac'].schedule[ts]['debug_lockInterference'] += [0] # debug only
-
-                                    # calculate pdr, including interference
-                                    sinr  = self._computeSINR(transmission['smac'],transmission['dmac'],interferers)
-                                    pdr   = self._computePdrFromSINR(sinr, transmission['dmac'])
-
-                                    # pick a random number
-                                    failure = random.random()
-                                    if pdr>=failure:
-                                        # packet is received correctly
-                                        # this mote is delivered the packet
-                                        isACKed, isNACKed = self.receivers[i]['mote'].radio_rxDone(
-                                            type       = transmission['type'],
-                                            smac       = transmission['smac'],
-                                            dmac       = transmission['dmac'],
-                                            payload    = transmission['payload']
-                                        )
-                                        # this mote stops listening
-                                        del self.receivers[i]
-
-                                    else:
-                                        # packet is NOT received correctly
-                                        self.receivers[i]['mote'].radio_rxDone()
-                                        del self.receivers[i]
-
-                                else:
-                                    # mote locked in an interfering signal
+                        lockOn = transmission['smac']
+                        for itfr in interferers:
+                            if arrivalTime[itfr] < arrivalTime[lockOn] and itfr in audible:
+                                # lock on interference
+                                lockOn = itfr
 
-                                    # for debug
-                                    transmission['smac'].schedule[ts]['debug_lockInterference'] += [1]
+                        if lockOn == transmission['smac']:
+                            # mote locked in the current signal
+
+                            # calculate pdr, including interference
+                            sinr  = self._computeSINR(transmission['smac'],transmission['dmac'],interferers)
+                            pdr   = self._computePdrFromSINR(sinr, transmission['dmac'])
+
+                            # pick a random number
+                            failure = random.random()
+                            if pdr>=failure:
+                                # packet is received correctly
+                                # this mote is delivered the packet
+                                isACKed, isNACKed = receiver['mote'].radio_rxDone(
+                                    type       = transmission['type'],
+                                    smac       = transmission['smac'],
+                                    dmac       = transmission['dmac'],
+                                    payload    = transmission['payload']
+                                )
 
-                                    # receive the interference as if it's a desired packet
-                                    interferers.remove(lockOn)
-                                    pseudo_interferers = interferers + [transmission['smac']]
+                            else:
+                                # packet is NOT received correctly
+                                receiver['mote'].radio_rxDone()
 
-                                    # calculate SINR where locked interference and other signals are considered S and I+N respectively
-                                    pseudo_sinr  = self._computeSINR(lockOn,transmission['dmac'],pseudo_interferers)
-                                    pseudo_pdr   = self._computePdrFromSINR(pseudo_sinr, transmission['dmac'])
+                        else:
+                            # mote locked in an interfering signal
 
-                                    # pick a random number
-                                    failure = random.random()
-                                    if pseudo_pdr>=failure:
-                                        # success to receive the interference and realize collision
-                                        transmission['dmac'].schedule[ts]['rxDetectedCollision'] = True
+                            # for debug
+                            if self.settings.debugCells:
+                                transmission['smac'].schedule[ts]['debug_lockInterference'] += 1
 
-                                    # desired packet is not received
-                                    self.receivers[i]['mote'].radio_rxDone()
-                                    del self.receivers[i]
+                            # receive the interference as if it's a desired packet
+                            interferers.remove(lockOn)
+                            pseudo_interferers = interferers + [transmission['smac']]
 
-                            else:
+                            # calculate SINR where locked interference and other signals are considered S and I+N respectively
+                            pseudo_sinr  = self._computeSINR(lockOn,transmission['dmac'],pseudo_interferers)
+                            pseudo_pdr   = self._computePdrFromSINR(pseudo_sinr, transmission['dmac'])
 
-                                #================ without interference ========
+                            # pick a random number
+                            failure = random.random()
+                            if pseudo_pdr>=failure:
+                                # success to receive the interference and realize collision
+                                transmission['dmac'].schedule[ts]['rxDetectedCollision'] = True
 
-                                interferers = []
+                            # desired packet is not received
+                            receiver['mote'].radio_rxDone()
 
-                                transmission['smac'].schedule[ts]['debug_interference']     += [0] # for debug only
-                                transmission['smac'].schedule[ts]['debug_lockInterference'] += [0] # for debug only
+                    else:
 
-                                # calculate pdr with no interference
-                                sinr  = self._computeSINR(transmission['smac'],transmission['dmac'],interferers)
-                                pdr   = self._computePdrFromSINR(sinr, transmission['dmac'])
+                        #================ without interference ========
 
-                                # pick a random number
-                                failure = random.random()
+                        interferers = []
 
-                                if pdr>=failure:
-                                    # packet is received correctly
-                                    # this mote is delivered the packet
-                                    isACKed, isNACKed = self.receivers[i]['mote'].radio_rxDone(
-                                        type       = transmission['type'],
-                                        smac       = transmission['smac'],
-                                        dmac       = transmission['dmac'],
-                                        payload    = transmission['payload']
-                                    )
+                        # calculate pdr with no interference
+                        sinr  = self._computeSINR(transmission['smac'],transmission['dmac'],interferers)
+                        pdr   = self._computePdrFromSINR(sinr, transmission['dmac'])
 
-                                    # this mote stops listening
-                                    del self.receivers[i]
+                        # pick a random number
+                        failure = random.random()
 
-                                else:
-                                    # packet is NOT received correctly
-                                    self.receivers[i]['mote'].radio_rxDone()
-                                    del self.receivers[i]
+                        if pdr>=failure:
+                            # packet is received correctly
+                            # this mote is delivered the packet
+                            isACKed, isNACKed = receiver['mote'].radio_rxDone(
+                                type       = transmission['type'],
+                                smac       = transmission['smac'],
+                                dmac       = transmission['dmac'],
+                                payload    = transmission['payload']
+                            )
 
                         else:
-                            # this packet is NOT destined for this mote
-
-                            # move to the next receiver
-                            i += 1
-
-                    else:
-                        # this receiver is NOT listening on the right channel
-
-                        # move to the next receiver
-                        i += 1
+                            # packet is NOT received correctly
+                            receiver['mote'].radio_rxDone()
 
                 # indicate to source packet was sent
                 transmission['smac'].radio_txDone(isACKed, isNACKed)
 
             # remaining receivers that does not receive a desired packet
-            for r in self.receivers:
+            for r in self._remainingReceivers():
 
                 if not self.settings.noInterference:
 
                     #================ with interference ===========
 
-                    interferers = [t['smac'] for t in self.transmissions if t['dmac']!=r['mote'] and t['channel']==r['channel']]
+                    interferers = [t['smac'] for t in self.transmissionsByChannel.get(r['channel'],[]) if t['dmac']!=r['mote']]
+                    audible     = self.canInterfere[r['mote']]
 
                     lockOn = None
                     for itfr in interferers:
 
                         if not lockOn:
-                            if r['mote'].getRSSI(itfr)>r['mote'].minRssi:
+                            if itfr in audible:
                                 lockOn = itfr
                         else:
-                            if r['mote'].getRSSI(itfr)>r['mote'].minRssi and arrivalTime[itfr]<arrivalTime[lockOn]:
+                            if itfr in audible and arrivalTime[itfr]<arrivalTime[lockOn]:
                                 lockOn = itfr
 
                     if lockOn:
@@ -283,21 +265,36 @@ class Propagation(object):
                 r['mote'].radio_rxDone()
 
             # clear all outstanding transmissions
-            self.transmissions              = []
-            self.receivers                  = []
-
-        self._schedule_propagate()
+            self._clear()
 
     #======================== private =========================================
 
+    def _remainingReceivers(self):
+        ''' receivers that were not matched with a transmission, in the order they started listening '''
+        return [r for r in self.receivers if self.listening[r['channel']].get(r['mote']) is r]
+
+    def _clear(self):
+        ''' forget the transmissions and receivers of the slot that was propagated '''
+        self.receivers                 = []
+        self.listening                 = {}
+        self.transmissions             = []
+        self.transmissionsByChannel    = {}
+
     def _schedule_propagate(self):
-        with self.dataLock:
-            self.engine.scheduleAtAsn(
-                asn         = self.engine.getAsn()+1,# so propagation happens in next slot
-                cb          = self.propagate,
-                uniqueTag   = (None,'propagation'),
-                priority    = 1,
-            )
+        '''
+        Propagation only runs in slots where some mote started a TX or RX.
+        It happens at the end of that slot, after all active cells (priority 0).
+        '''
+        asn = self.engine.getAsn()
+        if self.propagateAsn==asn:
+            return
+        self.propagateAsn = asn
+        self.engine.scheduleAtAsn(
+            asn         = asn,
+            cb          = self.propagate,
+            uniqueTag   = (None,'propagation'),
+            priority    = 1,
+        )
 
     def _computeSINR(self,source,destination,interferers):
         ''' compute SINR  '''
@@ -340,3 +337,190 @@ class Propagation(object):
     def _mWTodBm(self, mW):
         ''' translate dBm to mW '''
         return 10*math.log10(mW)
+
+class VectorPropagation(Propagation):
+    '''
+    Same model as Propagation, but the SINR and PDR of all the receptions of a
+    slot are computed at once, from RSSI matrices loaded with numpy along with
+    the interference graph. Lock-on, collision detection, debug counters and
+    the order of the random draws and radio callbacks are those of
+    Propagation.propagate.
+    '''
+
+    def __init__(self,context):
+
+        if numpy is None:
+            raise ImportError('vectorized propagation requires numpy')
+
+        # initialize the parent class
+        Propagation.__init__(self,context)
+
+        # variables
+        self.rssiDbm                   = None # rssiDbm[a,b] is a.getRSSI(b)
+        self.rssiMw                    = None # same, in mW
+        self.noiseMw                   = None # indexed by mote id
+        self.minRssi                   = None # indexed by mote id
+
+    #======================== public ==========================================
+
+    def loadTopology(self):
+        ''' also load the RSSI matrices from the motes '''
+        Propagation.loadTopology(self)
+        with self.dataLock:
+            motes                      = sorted(self.engine.motes,key=lambda m: m.id)
+            numMotes                   = len(motes)
+            self.rssiDbm               = numpy.empty((numMotes,numMotes))
+            self.rssiDbm.fill(-numpy.inf) # unknown links are never heard
+            for mote in motes:
+                for (neighborId,rssi) in mote.getRSSIs():
+                    self.rssiDbm[mote.id,neighborId] = rssi
+            self.rssiMw                = numpy.power(10.0,self.rssiDbm/10.0)
+            self.noiseMw               = numpy.power(10.0,numpy.array([m.noisepower for m in motes],dtype=float)/10.0)
+            self.minRssi               = numpy.array([m.minRssi for m in motes],dtype=float)
+
+    def propagate(self):
+        ''' Simulate the propagation of pkts in a slot. '''
+
+        with self.dataLock:
+
+            asn   = self.engine.getAsn()
+            ts    = asn%self.settings.slotframeLength
+
+            transmissions = self.transmissions
+
+            #=== match each transmission with its listening destination, in order
+
+            matchedRx     = [self.listening.get(t['channel'],{}).pop(t['dmac'],None) for t in transmissions]
+            remaining     = self._remainingReceivers()
+
+            #=== compute all SINRs and PDRs of this slot
+
+            numTx         = len(transmissions)
+            src           = numpy.array([t['smac'].id for t in transmissions],dtype=int)
+            dst           = numpy.array([t['dmac'].id for t in transmissions],dtype=int)
+            chan          = numpy.array([t['channel'] for t in transmissions],dtype=int)
+            if self.settings.noInterference:
+                sameChan  = numpy.zeros((numTx,numTx),dtype=bool)
+                arrival   = numpy.zeros(numTx)
+            else:
+                sameChan  = chan[:,numpy.newaxis]==chan[numpy.newaxis,:]
+                arrival   = numpy.array([t['smac'].clock_getOffsetToDagRoot() for t in transmissions])
+            others        = sameChan.copy()
+            numpy.fill_diagonal(others,False)
+
+            # [i,j]: transmission i at the destination of transmission j
+            noise         = self.noiseMw[dst]
+            received      = self.rssiMw[src[:,numpy.newaxis],dst[numpy.newaxis,:]]-noise
+            heard         = numpy.maximum(received,0.0)
+            audible       = others & (self.rssiDbm[dst[numpy.newaxis,:],src[:,numpy.newaxis]]>self.minRssi[dst])
+
+            interference  = audible.any(axis=0)
+            pdr           = self._computePdrArray(
+                numpy.diagonal(received),
+                (heard*others).sum(axis=0),
+                noise,
+            )
+
+            # lock on the earliest audible interferer that arrived before the packet
+            early         = audible & (arrival[:,numpy.newaxis]<arrival[numpy.newaxis,:])
+            lockOn        = numpy.where(early,arrival[:,numpy.newaxis],numpy.inf).argmin(axis=0) if numTx else src
+            locked        = early.any(axis=0)
+            cols          = numpy.flatnonzero(locked)
+            lockPdr       = numpy.zeros(numTx)
+            lockPdr[cols] = self._computePdrArray(
+                received[lockOn[cols],cols],
+                (heard[:,cols]*sameChan[:,cols]).sum(axis=0)-heard[lockOn[cols],cols],
+                noise[cols],
+            )
+
+            # [i,r]: transmission i at remaining receiver r, which locks on the earliest audible one
+            rxMote        = numpy.array([r['mote'].id for r in remaining],dtype=int)
+            rxChan        = numpy.array([r['channel'] for r in remaining],dtype=int)
+            rxNoise       = self.noiseMw[rxMote]
+            rxOthers      = (chan[:,numpy.newaxis]==rxChan[numpy.newaxis,:]) & (dst[:,numpy.newaxis]!=rxMote[numpy.newaxis,:])
+            if self.settings.noInterference:
+                rxOthers[:] = False
+            rxReceived    = self.rssiMw[src[:,numpy.newaxis],rxMote[numpy.newaxis,:]]-rxNoise
+            rxHeard       = numpy.maximum(rxReceived,0.0)*rxOthers
+            rxAudible     = rxOthers & (self.rssiDbm[rxMote[numpy.newaxis,:],src[:,numpy.newaxis]]>self.minRssi[rxMote])
+            rxLockOn      = numpy.where(rxAudible,arrival[:,numpy.newaxis],numpy.inf).argmin(axis=0) if numTx else rxMote
+            rxCols        = numpy.flatnonzero(rxAudible.any(axis=0))
+            rxLockPdr     = numpy.empty(len(remaining))
+            rxLockPdr.fill(numpy.nan) # no lock-on, no random draw
+            rxLockPdr[rxCols] = self._computePdrArray(
+                rxReceived[rxLockOn[rxCols],rxCols],
+                rxHeard[:,rxCols].sum(axis=0)-rxHeard[rxLockOn[rxCols],rxCols],
+                rxNoise[rxCols],
+            )
+
+            #=== deliver, in the order of Propagation.propagate
+
+            for (j,transmission) in enumerate(transmissions):
+                isACKed     = False
+                isNACKed    = False
+
+                if matchedRx[j]:
+                    receiver = matchedRx[j]['mote']
+                    cell     = transmission['smac'].schedule[ts]
+
+                    if interference[j]:
+                        if self.settings.debugCells:
+                            cell['debug_interference'] += 1 # debug only
+                        transmission['smac'].stats_incrementRadioStats('probableCollisions')
+
+                    if not locked[j]:
+                        # mote locked in the current signal
+
+                        if pdr[j]>=random.random():
+                            # packet is received correctly
+                            isACKed, isNACKed = receiver.radio_rxDone(
+                                type       = transmission['type'],
+                                smac       = transmission['smac'],
+                                dmac       = transmission['dmac'],
+                                payload    = transmission['payload']
+                            )
+                        else:
+                            # packet is NOT received correctly
+                            receiver.radio_rxDone()
+                    else:
+                        # mote locked in an interfering signal
+                        if self.settings.debugCells:
+                            cell['debug_lockInterference'] += 1 # debug only
+
+                        if lockPdr[j]>=random.random():
+                            # success to receive the interference and realize collision
+                            transmission['dmac'].schedule[ts]['rxDetectedCollision'] = True
+
+                        # desired packet is not received
+                        receiver.radio_rxDone()
+
+                # indicate to source packet was sent
+                transmission['smac'].radio_txDone(isACKed, isNACKed)
+
+            # remaining receivers that does not receive a desired packet
+            for (r,receiver) in enumerate(remaining):
+                mote = receiver['mote']
+
+                if not numpy.isnan(rxLockPdr[r]) and rxLockPdr[r]>=random.random():
+                    # success to receive the interference and realize collision
+                    mote.schedule[ts]['rxDetectedCollision'] = True
+
+                # desired packet is not received
+                mote.radio_rxDone()
+
+            # clear all outstanding transmissions
+            self._clear()
+
+    #======================== private =========================================
+
+    def _computePdrArray(self,signal,interference,noise):
+        '''
+        PDR of each reception, from the received power (mW, noise removed),
+        total interference (mW) and noise (mW) at its receiver.
+        '''
+        sinr           = numpy.empty(len(signal))
+        below          = signal<0.0
+        sinr[below]    = -10.0 # RSSI below noise level
+        sinr[~below]   = 10*numpy.log10(signal[~below]/(interference[~below]+noise[~below]))
+        equivalentRSSI = 10*numpy.log10(numpy.power(10.0,sinr/10.0)*noise+noise)
+        return Topology.Topology.rssiToPdrArray(equivalentRSSI)
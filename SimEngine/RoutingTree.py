@@ -0,0 +1,79 @@
+#!/usr/bin/python
+'''
+\brief Routing tree of the motes, by rank.
+
+Each mote's parent is its neighbor with the lowest rank (the first one, by id,
+among equals). The tree is built once from the topology (see
+Topology.getRoutingTree) and gives the parent and children of each mote, and
+the number of packets each mote sends per slotframe: its own and those of its
+children, aggregated from the leaves in a single pass.
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('RoutingTree')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ imports =========================================
+
+#============================ defines =========================================
+
+DAGROOT_ID       = 0 # keeps the packets of its children, it does not forward them
+
+#============================ body ============================================
+
+class RoutingTree(object):
+
+    def __init__(self,motes):
+        '''
+        \param motes The motes, with their rank and neighbors set.
+        '''
+
+        size             = max([mote.id for mote in motes]+[-1])+1
+        self.motes       = [None]*size                    # motes, by id
+        self.parents     = [None]*size                    # id of each mote's parent, None if it has no neighbor
+        self.children    = [[] for _ in range(size)]      # ids of each mote's children, in increasing order
+        self.load        = [0]*size                       # packets each mote sends per slotframe
+        self.order       = []                             # ids of the motes, leaves first
+
+        for mote in motes:
+            self.motes[mote.id] = mote
+            self.load[mote.id]  = 1
+
+        # pick the parents
+        for mote in motes:
+            neighbors = mote._myNeigbors()
+            if neighbors:
+                parent = min(neighbors,key=lambda m: m.getMoteRank())
+                self.parents[mote.id] = parent.id
+                self.children[parent.id].append(mote.id)
+
+        # aggregate the load, from the highest rank down
+        self.order       = [mote.id for mote in sorted(motes,key=lambda m: m.getMoteRank(),reverse=True)]
+        for id in self.order:
+            parent = self.parents[id]
+            if parent is not None and parent!=DAGROOT_ID:
+                self.load[parent] += self.load[id]
+
+    #======================== public ==========================================
+
+    def getParent(self,mote):
+        ''' the mote's parent, None if it has no neighbor '''
+        parent = self.parents[mote.id]
+        return None if parent is None else self.motes[parent]
+
+    def getChildren(self,mote):
+        return [self.motes[id] for id in self.children[mote.id]]
+
+    def getLoad(self,mote):
+        ''' packets the mote sends per slotframe, its own and its children's '''
+        return self.load[mote.id]
+
+    def getLinks(self):
+        ''' ((id,parent id),load) of each mote with a parent, by id '''
+        return [((id,parent),self.load[id]) for (id,parent) in enumerate(self.parents) if parent is not None]
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+'''
+\brief Network-wide index of the installed TSCH cells.
+
+Maps each (timeslot, channel) pair to the motes transmitting and receiving
+in it. Motes keep it up to date as they add and remove cells, so schedule
+collisions can be found without walking every mote's schedule.
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('ScheduleIndex')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ imports =========================================
+
+import Mote
+
+#============================ defines =========================================
+
+#============================ body ============================================
+
+class ScheduleIndex(object):
+
+    def __init__(self):
+
+        # variables
+        self.transmitters              = {} # indexed by (ts,ch), set of motes with a TX cell
+        self.receivers                 = {} # indexed by (ts,ch), set of motes with an RX cell
+
+    #======================== public ==========================================
+
+    def addCell(self,mote,ts,ch,dir):
+        ''' record a cell installed in the schedule of a mote '''
+        self._occupants(dir).setdefault((ts,ch),set()).add(mote)
+
+    def removeCell(self,mote,ts,ch,dir):
+        ''' forget a cell removed from the schedule of a mote '''
+        occupants = self._occupants(dir)
+        occupants[(ts,ch)].remove(mote)
+        if not occupants[(ts,ch)]:
+            del occupants[(ts,ch)]
+
+    def getTransmitters(self,ts,ch):
+        ''' motes with a TX cell at (ts,ch) '''
+        return self.transmitters.get((ts,ch),set())
+
+    def getReceivers(self,ts,ch):
+        ''' motes with an RX cell at (ts,ch) '''
+        return self.receivers.get((ts,ch),set())
+
+    def getSharedTxCells(self):
+        ''' (ts,ch) of the cells in which more than one mote transmits, with those motes '''
+        return dict((cell,motes) for (cell,motes) in self.transmitters.items() if len(motes)>1)
+
+    #======================== private =========================================
+
+    def _occupants(self,dir):
+        if dir==Mote.Mote.DIR_TX:
+            return self.transmitters
+        else:
+            return self.receivers
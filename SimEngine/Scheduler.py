@@ -7,18 +7,25 @@
 
 from Link import Link
 
-import SimSettings
-import SimEngine
-
-
-import Mote
 import random
+import heapq
+import time
+import os
+import gzip
+import hashlib
+import cPickle
+import collections
 
+#schedules computed in this process, by key (see Scheduler._scheduleKey), least recently
+#used first
+_scheduleCache = collections.OrderedDict()
+SCHEDULE_CACHE_SIZE = 16 #schedules kept in _scheduleCache
 
 
 class Scheduler(object):
-    def __init__(self):
-        self.setting = SimSettings.SimSettings()
+    def __init__(self,context):
+        self.engine = context.engine
+        self.settings = context.settings
         self.schedules  = {}
         self.linksavailable ={}
         self.links           = []
@@ -26,67 +33,51 @@ class Scheduler(object):
         self.linksrequired   = []
         self.linksList       = []
         self.slotFrameSize   = 1
-        self.timeslots       = self.setting.slotframeLength
-        self. channels =self.setting.numChans
+        self.timeslots       = self.settings.slotframeLength
+        self. channels =self.settings.numChans
         self.slotFrame = [[None for ts in range(self.timeslots)] for ts in range(self.channels)]
+        self.busyNodes = [0 for ts in range(self.timeslots)] #bitset of the nodes with a link in each timeslot (see Link.nodes)
+        self.nextChannel = [0 for ts in range(self.timeslots)] #first free channel of each timeslot
+        #the current schedule, kept for rescheduleLinks
+        self.linksByNodes = {} #link of each (sendNode,rcvNode)
+        self.linkCells = {} #(timeslot,channel) cells of each (sendNode,rcvNode), by timeslot
+        self.freeChannels = [set() for ts in range(self.timeslots)] #free channels of each timeslot
+        self.nextUpdateAsn = None #ASN of the next rescheduling, see startUpdates
+        self.measureAsn = 0 #ASN the motes started measuring the demand of the next rescheduling from
+        self.updates = [] #asn, duration (s) and cells added and removed of each rescheduling
 
-    def generateCompartibleLinks(self,linksList):
-        count =0
-        updatedList =[]
-
-        for link1 in linksList:
-            for link2 in linksList:
-
-                if not link1.sharesNode(link2):
-                    link1.addCompartibleLink(link2)
-        return linksList
-    def chooseNextLink(self,linksList):
-        #sort in descending order based on timesToSchedule and timesScheduledAlready
-        linksList.sort(key=lambda x:(x.timesToSchedule,-x.timesScheduledAlready),reverse=True)
-        return linksList[0]
+    def chooseNextLink(self,linksHeap):
+        #pop the link with the most times to schedule, then the fewest times scheduled already.
+        #Ties go to the link chosen last, then to the first one in the links list
+        #(see schedule), as sorting the list in place used to
+        return heapq.heappop(linksHeap)[-1]
 
     def isConstraints(self,link,timeSlot):
-        #checks if the assignment link to the passed timeSlot fails dues to any constraint
-        singleSlot=[row[timeSlot] for row in  self.slotFrame]
-        if any(x==link for x in singleSlot):
-            return True
-        for link1 in singleSlot:
-            if link1==None:
-                continue
-            if not link.isCompartible(link1):
-                return True
-        return False
+        #checks if the assignment link to the passed timeSlot fails dues to any constraint:
+        #it is not compartible with a link in the timeSlot, i.e. one of its nodes is busy
+        return (self.busyNodes[timeSlot] & link.nodes)!=0
 
     def schedule(self,linksList):
+        self._placeLinks(linksList)
+        return self._shuffleChannels()
+
+    def _placeLinks(self,linksList):
         #SlotFrame=[[None for ts in range(timeslots)] for ts in range(channels)]
         for i in range(self.channels):
             for j in range(self.timeslots):
                 self.slotFrame[i][j] = None
-        linksList = self.generateCompartibleLinks(linksList)
-        linksListCopy = linksList[:]
-        while(len(linksListCopy)>0):
-            cur_link = self.chooseNextLink(linksListCopy)
-            linkassigned = False
-            channelOffset,timeSlot =0,0
-            while(timeSlot<self.timeslots):
-                if channelOffset==self.channels:
-                    timeSlot+=1
-                    channelOffset=0
-                if not self.slotFrame[channelOffset][timeSlot] == None:
-                    channelOffset+=1
-                    continue
-                if not self.isConstraints(cur_link,timeSlot):
-                    self.slotFrame[channelOffset][timeSlot]=cur_link
-                    linkassigned =True
-                    break
-                else:
-                    timeSlot+=1
-                    channelOffset=0
-                    continue
-            cur_link.reduceTimeToSchedule()
-            if cur_link.timesToSchedule==0:
-                del linksListCopy[linksListCopy.index(cur_link)]
+        for j in range(self.timeslots):
+            self.busyNodes[j] = 0
+            self.nextChannel[j] = 0
+        if self.settings.schedulingPolicy=='tasa':
+            self._scheduleAlongTree(linksList)
+        else:
+            self._scheduleByDemand(linksList)
+        return self.slotFrame
+
+    def _shuffleChannels(self):
         #Randomise channels assigned to each links
+        #(it draws the same random numbers whatever the links, see _loadSchedule)
         linksdict ={}
         for ts in range(self.timeslots):
             for j in range(self.channels):
@@ -103,22 +94,16 @@ class Scheduler(object):
         return self.slotFrame
 
     def createLinks(self):
-        self.links=[]
-	#establishing how many packets each mote has to send in a single slot frame
-	motes = sorted(self.engine.motes, key=lambda mote: mote.getMoteRank(),reverse=True)
-        for mote in motes:
-            neighbors =mote._myNeigbors()
-            if neighbors:
-                parent=sorted(neighbors, key=lambda mote: mote.getMoteRank())[0]
-                if not parent.id==0:
-                    parent._increasePacketsToSend(mote.packetsTosend)
-	#creating links. Each mote creates a link with it's parent ie the neighbor with the closest rank
-        for mote in self.engine.motes:
-            neighbors =mote._myNeigbors()
-            if neighbors:
-                parent=sorted(neighbors, key=lambda mote: mote.getMoteRank())[0]
-		#each link consists of the sender mote, receiver(parent) and the number of packets to send
-                self.links.append(tuple([tuple([mote.id,parent.id]),mote.packetsTosend]))
+        #each mote creates a link with it's parent, carrying the packets it sends in a single
+        #slot frame: those it measured (see Mote.measurePacketsToSend) or, until it has,
+        #its own and its children's (see RoutingTree)
+        tree = self.engine.topology.getRoutingTree()
+        self.links = []
+        for (nodes,load) in tree.getLinks():
+            packetsTosend = tree.motes[nodes[0]].packetsTosend
+            if packetsTosend == None:
+                packetsTosend = load
+            self.links.append((nodes,packetsTosend))
         return self.links
 
     def createLinksList(self):
@@ -133,7 +118,9 @@ class Scheduler(object):
     def updateMoteSchedules(self):
         motes_timeslot={}
         linksList = [m for m in self.createLinksList()]
-        slotFrame =self.schedule(linksList)
+        if self._loadSchedule(linksList) == None:
+            self._storeSchedule(self._placeLinks(linksList))
+        slotFrame = self._shuffleChannels()
         for i in range(self.channels):
             for j in range(self.timeslots):
                 link=slotFrame[i][j]
@@ -151,20 +138,290 @@ class Scheduler(object):
                     if (j+1)>self.slotFrameSize:
                         self.slotFrameSize=(j+1)
         #double the slot frame to create free time slots
-        self.slotFrameSize = self.setting.slotframeLength
+        self.slotFrameSize = self.settings.slotframeLength
         for mote in self.engine.motes:
             if motes_timeslot.has_key(mote.id):
                 mote.assignSchedule(motes_timeslot[mote.id],self.slotFrameSize)
+        self._indexSchedule(linksList)
 
-    def getUpdatePeriod(self):
-        return 10000
+    def rescheduleLinks(self):
+        #re-plan only the links which are new, gone, or have another number of packets to
+        #send than they have cells (also when there was no room for all of them when they
+        #were placed): free the cells they no longer need, place the ones they now need,
+        #and send only these changes to the motes.
+        #Returns the number of cells added and removed
+        links = dict(self.createLinks())
+        changed = [nodes for nodes in self.linksByNodes if links.get(nodes)!=len(self.linkCells[nodes])]
+        changed += [nodes for nodes in links if nodes not in self.linksByNodes]
+        addedCells = {}
+        removedCells = {}
 
+        #free the cells of the links which are gone or need fewer
+        for nodes in sorted(changed):
+            if nodes not in self.linksByNodes:
+                continue
+            link = self.linksByNodes[nodes]
+            cells = self.linkCells[nodes]
+            numKept = links.get(nodes,0)
+            for (ts,ch) in cells[numKept:]:
+                self._freeCell(link,ts,ch,removedCells)
+            del cells[numKept:]
+            if nodes not in links:
+                del self.linksByNodes[nodes]
+                del self.linkCells[nodes]
+                self.linksList.remove(link)
 
+        #place the cells of the links which are new or need more, most packets first
+        linkId = max([link.id for link in self.linksList]+[0])
+        for nodes in sorted([nodes for nodes in changed if nodes in links],key=lambda nodes: (-links[nodes],nodes)):
+            if nodes not in self.linksByNodes:
+                linkId += 1
+                self.linksByNodes[nodes] = Link(nodes,links[nodes],linkId)
+                self.linkCells[nodes] = []
+                self.linksList.append(self.linksByNodes[nodes])
+            link = self.linksByNodes[nodes]
+            link.packetsToCarry = links[nodes]
+            cells = self.linkCells[nodes]
+            for ts in range(self.timeslots):
+                if len(cells)>=link.packetsToCarry:
+                    break
+                if self.freeChannels[ts] and not self.isConstraints(link,ts):
+                    ch = random.choice(sorted(self.freeChannels[ts]))
+                    self._useCell(link,ts,ch,addedCells)
+                    cells.append((ts,ch))
+            cells.sort()
+
+        for mote in self.engine.motes:
+            if addedCells.has_key(mote.id) or removedCells.has_key(mote.id):
+                mote.updateSchedule(addedCells.get(mote.id,[]),removedCells.get(mote.id,[]))
+        return (sum([len(c) for c in addedCells.values()])/2,sum([len(c) for c in removedCells.values()])/2)
 
-    @property
-    def engine(self):
-        return SimEngine.SimEngine(failIfNotInit=True)
+    def _scheduleByDemand(self,linksList):
+        #one cell at a time, to the link with the most packets left to schedule, in the
+        #first timeslot it fits in
+        for link in linksList:
+            link.earliestTimeSlot = 0
+        #links heap, by (-timesToSchedule,timesScheduledAlready,-step chosen last,position in linksList)
+        linksHeap = [(-link.timesToSchedule,link.timesScheduledAlready,0,i,link) for (i,link) in enumerate(linksList)]
+        heapq.heapify(linksHeap)
+        step = 0
+        while(len(linksHeap)>0):
+            cur_link = self.chooseNextLink(linksHeap)
+            step+=1
+            #timeslots only fill up, so the ones before the link's cursor stay unusable
+            timeSlot = self._firstFreeTimeslot(cur_link,cur_link.earliestTimeSlot)
+            if timeSlot!=None:
+                cur_link.earliestTimeSlot = timeSlot
+                self._placeLink(cur_link,timeSlot)
+            else:
+                cur_link.earliestTimeSlot = self.timeslots
+            cur_link.reduceTimeToSchedule()
+            if cur_link.timesToSchedule>0:
+                heapq.heappush(linksHeap,(-cur_link.timesToSchedule,cur_link.timesScheduledAlready,-step,0,cur_link))
+
+    def _scheduleAlongTree(self,linksList):
+        #TASA-like: follow the packets of one slotframe from the mote which generates them to
+        #the DAG root, giving each hop the first cell after the packet reaches the mote, so a
+        #packet can reach the DAG root in the slotframe it is generated in. The packets a
+        #mote generates are those its link carries beyond its children's, and they are ready
+        #once the application has generated them (see _generationSlot). Packets furthest
+        #from the DAG root go first. The cells left, e.g. for retransmissions, go where they
+        #fit first, as in _scheduleByDemand
+        linkOf = dict((link.sendNode,link) for link in linksList)
+        parents = dict((link.sendNode,link.rcvNode) for link in linksList)
+        depths = {}
+        for link in linksList:
+            self._treeDepth(link.sendNode,parents,depths)
+        fromChildren = {}
+        for link in linksList:
+            fromChildren[link.rcvNode] = fromChildren.get(link.rcvNode,0)+link.timesToSchedule
+        #packets heap, by (timeslot ready at,-hops to the DAG root,position in linksList)
+        packetsHeap = []
+        for (i,link) in enumerate(linksList):
+            for k in range(link.timesToSchedule-fromChildren.get(link.sendNode,0)):
+                packetsHeap.append((self._generationSlot(),-depths[link.sendNode],i,link.sendNode))
+        heapq.heapify(packetsHeap)
+        while(len(packetsHeap)>0):
+            (ready,negDepth,i,node) = heapq.heappop(packetsHeap)
+            cur_link = linkOf[node]
+            if cur_link.timesToSchedule==0:
+                continue
+            #or in the next slotframe, when this one is full
+            timeSlot = self._firstFreeTimeslot(cur_link,ready)
+            if timeSlot==None:
+                timeSlot = self._firstFreeTimeslot(cur_link,0)
+            if timeSlot==None:
+                continue
+            self._placeLink(cur_link,timeSlot)
+            cur_link.reduceTimeToSchedule()
+            if cur_link.rcvNode in linkOf and cur_link.rcvNode!=0:
+                heapq.heappush(packetsHeap,(timeSlot+1,negDepth+1,i,cur_link.rcvNode))
+        self._scheduleByDemand([link for link in linksList if link.timesToSchedule>0])
 
-    @property
-    def settings(self):
-        return SimSettings.SimSettings(failIfNotInit=True)
+    def _generationSlot(self):
+        #timeslot by which the application has generated its packet of the slotframe: the
+        #first one goes out up to pkPeriod after boot, then one per slotframe (see
+        #Mote._app_schedule_sendSinglePacket). A cell in that timeslot comes before it
+        slot = int(1+self.settings.pkPeriod/self.settings.slotDuration)+1
+        if slot>=self.timeslots:
+            return 0
+        return slot
+
+    def _treeDepth(self,node,parents,depths):
+        #hops from node to the DAG root (or to where its parents loop), kept in depths
+        path = []
+        while node!=0 and node in parents and node not in depths and node not in path:
+            path.append(node)
+            node = parents[node]
+        depth = depths.setdefault(node,0)
+        for n in reversed(path):
+            depth += 1
+            depths[n] = depth
+
+    def _firstFreeTimeslot(self,link,timeSlot):
+        #first timeslot from this one with a free channel and both nodes of the link free
+        while timeSlot<self.timeslots and (self.nextChannel[timeSlot]==self.channels or self.isConstraints(link,timeSlot)):
+            timeSlot+=1
+        if timeSlot<self.timeslots:
+            return timeSlot
+        return None
+
+    def _placeLink(self,link,timeSlot):
+        #each timeslot is filled from channel 0 on
+        self.slotFrame[self.nextChannel[timeSlot]][timeSlot]=link
+        self.nextChannel[timeSlot]+=1
+        self.busyNodes[timeSlot] |= link.nodes
+
+    def _scheduleKey(self):
+        #the placement only depends on the links (the parent tree and the packets to send on
+        #each of them), on the size of the slotframe and the policy and, along the tree, on
+        #the slot the packets are generated in
+        inputs = [self.settings.schedulingPolicy,self.timeslots,self.channels,self.links]
+        if self.settings.schedulingPolicy=='tasa':
+            inputs.append(self._generationSlot())
+        return hashlib.sha1(repr(tuple(inputs))).hexdigest()
+
+    def _scheduleFile(self,key):
+        return os.path.join(self.settings.scheduleCacheDir,'schedule_{0}.pkl.gz'.format(key))
+
+    def _loadSchedule(self,linksList):
+        #the slotFrame of linksList from the schedule cache, in memory then on disk, None if
+        #it is not there. The cache holds the links placed by _placeLinks, before their
+        #channels are shuffled, so the run then shuffles them, and draws the same random
+        #numbers, as if it had not used the cache
+        if not (self.settings.scheduleCache or self.settings.scheduleCacheDir):
+            return None
+        key = self._scheduleKey()
+        cells = _scheduleCache.pop(key,None)
+        if cells == None and self.settings.scheduleCacheDir and os.path.exists(self._scheduleFile(key)):
+            with gzip.open(self._scheduleFile(key),'rb') as f:
+                cells = cPickle.load(f)
+        if cells != None and self.settings.scheduleCache:
+            self._cacheSchedule(key,cells)
+        if cells == None:
+            return None
+        linksByNodes = dict(((link.sendNode,link.rcvNode),link) for link in linksList)
+        for i in range(self.channels):
+            for j in range(self.timeslots):
+                self.slotFrame[i][j] = None
+        for (ch,ts,sendNode,rcvNode) in cells:
+            link = linksByNodes[(sendNode,rcvNode)]
+            self.slotFrame[ch][ts] = link
+            link.reduceTimeToSchedule()
+        return self.slotFrame
+
+    def _storeSchedule(self,slotFrame):
+        #add slotFrame, as placed by _placeLinks, to the schedule cache
+        if not (self.settings.scheduleCache or self.settings.scheduleCacheDir):
+            return
+        key = self._scheduleKey()
+        cells = [(ch,ts,slotFrame[ch][ts].sendNode,slotFrame[ch][ts].rcvNode) for ch in range(self.channels) for ts in range(self.timeslots) if slotFrame[ch][ts] != None]
+        if self.settings.scheduleCache:
+            self._cacheSchedule(key,cells)
+        if self.settings.scheduleCacheDir:
+            if not os.path.exists(self.settings.scheduleCacheDir):
+                os.makedirs(self.settings.scheduleCacheDir)
+            #write then rename, so runs sharing the directory never read half a file
+            tmpFile = '{0}.{1}.tmp'.format(self._scheduleFile(key),os.getpid())
+            with gzip.open(tmpFile,'wb') as f:
+                cPickle.dump(cells,f,cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmpFile,self._scheduleFile(key))
+
+    def _cacheSchedule(self,key,cells):
+        #keep cells in memory as the most recently used schedule, and forget the least
+        #recently used ones beyond SCHEDULE_CACHE_SIZE
+        _scheduleCache.pop(key,None)
+        _scheduleCache[key] = cells
+        while len(_scheduleCache)>SCHEDULE_CACHE_SIZE:
+            _scheduleCache.popitem(last=False)
+
+    def _indexSchedule(self,linksList):
+        #index the slotFrame just scheduled, for rescheduleLinks
+        self.linksByNodes = dict(((link.sendNode,link.rcvNode),link) for link in linksList)
+        self.linkCells = dict((nodes,[]) for nodes in self.linksByNodes)
+        for ts in range(self.timeslots):
+            self.busyNodes[ts] = 0
+            self.freeChannels[ts] = set()
+            for ch in range(self.channels):
+                link = self.slotFrame[ch][ts]
+                if link == None:
+                    self.freeChannels[ts].add(ch)
+                else:
+                    self.busyNodes[ts] |= link.nodes
+                    self.linkCells[(link.sendNode,link.rcvNode)].append((ts,ch))
+
+    def _useCell(self,link,ts,ch,cells):
+        #give the cell to the link, and record the cells of its motes in cells
+        self.slotFrame[ch][ts] = link
+        self.freeChannels[ts].remove(ch)
+        self.busyNodes[ts] |= link.nodes
+        cells.setdefault(link.sendNode,[]).append((ts,self.engine.motes[0].DIR_TX,link.rcvNode,ch))
+        cells.setdefault(link.rcvNode,[]).append((ts,self.engine.motes[0].DIR_RX,link.sendNode,ch))
+
+    def _freeCell(self,link,ts,ch,cells):
+        #take the cell back from the link, and record the cells of its motes in cells
+        self.slotFrame[ch][ts] = None
+        self.freeChannels[ts].add(ch)
+        self.busyNodes[ts] &= ~link.nodes
+        cells.setdefault(link.sendNode,[]).append((ts,self.engine.motes[0].DIR_TX,link.rcvNode,ch))
+        cells.setdefault(link.rcvNode,[]).append((ts,self.engine.motes[0].DIR_RX,link.sendNode,ch))
+
+    def startUpdates(self):
+        #reschedule every getUpdatePeriod() slots from now on, at the end of a slotframe,
+        #for the packets the motes send in between
+        self.measureAsn = self.engine.getAsn()
+        if self.getUpdatePeriod():
+            self._scheduleUpdate(self.engine.getAsn()+self.getUpdatePeriod())
+
+    def getUpdatePeriod(self):
+        return self.settings.schedulerUpdatePeriod
+
+    def _endOfSlotframe(self,asn):
+        #last slot of the slotframe asn is in
+        return asn+self.timeslots-1-asn%self.timeslots
+
+    def _scheduleUpdate(self,asn):
+        #after all the other events of that slot, so the new cells are used from the next
+        #slotframe on
+        self.nextUpdateAsn = self._endOfSlotframe(asn)
+        self.engine.scheduleAtAsn(
+            asn         = self.nextUpdateAsn,
+            cb          = self._actionUpdate,
+            uniqueTag   = (None,'_actionUpdate'),
+            priority    = 11,
+        )
+
+    def _actionUpdate(self):
+        startTime = time.time()
+        numSlotframes = float(self.engine.getAsn()+1-self.measureAsn)/self.timeslots
+        for mote in self.engine.motes:
+            mote.measurePacketsToSend(numSlotframes)
+        self.measureAsn = self.engine.getAsn()+1
+        (numAdded,numRemoved) = self.rescheduleLinks()
+        self.updates.append({
+            'asn':             self.engine.getAsn(),
+            'duration':        time.time()-startTime,
+            'cellsAdded':      numAdded,
+            'cellsRemoved':    numRemoved,
+        })
+        self._scheduleUpdate(self.engine.getAsn()+self.getUpdatePeriod())
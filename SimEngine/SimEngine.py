@@ -20,17 +20,85 @@ log.addHandler(NullHandler())
 
 #============================ imports =========================================
 
+import os
+import sys
+import gzip
+import types
+import random
+import cPickle
+import copy_reg
 import threading
+import heapq
 
-import Propagation
-import Topology
-import Mote
 import SimSettings
-import Scheduler
+import SimulationContext
+from MoteTimer import MoteTimer
+
 #============================ defines =========================================
 
+CHECKPOINT_PROTOCOL = 1 # rebuilds objects without calling the singletons' __new__
+
+#============================ helpers =========================================
+
+# events hold bound methods, which pickle does not handle by itself
+def _pickleMethod(method):
+    return (getattr, (method.im_self, method.im_func.__name__))
+copy_reg.pickle(types.MethodType, _pickleMethod)
+
+def getCheckpointFile(filename,runNum):
+    '''
+    The checkpoint file of run runNum: filename with the run number inserted
+    before its extensions (checkpoint.pkl.gz -> checkpoint_run2.pkl.gz).
+    '''
+    (dirname,basename) = os.path.split(filename)
+    (name,dot,ext)     = basename.partition('.')
+    return os.path.join(dirname,'{0}_run{1}{2}{3}'.format(name,runNum,dot,ext))
+
+def loadCheckpoint(filename):
+    '''
+    Restores a simulation saved by SimEngine.saveCheckpoint.
+
+    Returns its SimulationContext, ready to continue with context.run().
+    This also restores the state of the random number generator.
+    '''
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(),10000))
+    with gzip.open(filename,'rb') as f:
+        (randomState,context) = cPickle.load(f)
+
+    # recreate what is not saved in a checkpoint
+    engine                     = context.engine
+    threading.Thread.__init__(engine)
+    engine.name                = 'SimEngine'
+    engine.dataLock            = engine.newLock()
+    engine.pauseSem            = threading.Semaphore(0)
+    engine.startCb             = [] # were called before the checkpoint
+    context.propagation.dataLock = engine.newLock(reentrant=False)
+    for mote in context.motes:
+        mote.dataLock          = engine.newLock()
+        mote.timer             = MoteTimer(context.settings.slotDuration/1000,mote.updateTimeSlot)
+
+    random.setstate(randomState)
+
+    return context
+
 #============================ body ============================================
 
+class NullLock(object):
+    ''' Stands in for a lock when no other thread touches the simulation. '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        return False
+
+    def acquire(self,blocking=1):
+        return True
+
+    def release(self):
+        pass
+
 class SimEngine(threading.Thread):
 
     #===== start singleton
@@ -38,60 +106,67 @@ class SimEngine(threading.Thread):
     _init          = False
 
     def __new__(cls, *args, **kwargs):
+        if kwargs.get('context'):
+            # an engine owned by a SimulationContext is not shared
+            return super(SimEngine,cls).__new__(cls)
         if not cls._instance:
             cls._instance = super(SimEngine,cls).__new__(cls, *args, **kwargs)
         return cls._instance
     #===== end singleton
 
-    def __init__(self,runNum=None,failIfNotInit=False):
+    def __init__(self,runNum=None,failIfNotInit=False,context=None):
+
+        if not context:
 
-        if failIfNotInit and not self._init:
-            raise EnvironmentError('SimEngine singleton not initialized.')
+            if failIfNotInit and not self._init:
+                raise EnvironmentError('SimEngine singleton not initialized.')
 
-        #===== start singleton
-        if self._init:
-            return
-        self._init = True
-        #===== end singleton
+            #===== start singleton
+            if self._init:
+                return
+            self._init = True
+            #===== end singleton
 
         # store params
         self.runNum                         = runNum
 
         # local variables
-        self.dataLock                       = threading.RLock()
+        if context:
+            self.settings                   = context.settings
+        else:
+            self.settings                   = SimSettings.SimSettings()
+        self.dataLock                       = self.newLock()
         self.pauseSem                       = threading.Semaphore(0)
         self.simPaused                      = False
         self.goOn                           = True
         self.asn                            = 0
         self.startCb                        = []
         self.endCb                          = []
-        self.events                         = []
-        self.settings                       = SimSettings.SimSettings()
-        self.propagation                    = Propagation.Propagation()
-        self.motes                          = [Mote.Mote(id) for id in range(self.settings.numMotes)]
-        self.topology                       = Topology.Topology(self.motes)
-        self.scheduler                      = Scheduler.Scheduler()
-
-        #self.LinkSchedules                  = LinkSchedules.LinkSchedules(self.motes)
-        self.topology.createTopology()
-
-        # run Scheduler
-        self.scheduler.updateMoteSchedules()
-
-        # boot all motes
-        for i in range(len(self.motes)):
-            self.motes[i].boot()
-
+        self.events                         = [] # heap of [asn,priority,seq,cb,uniqueTag]
+        self.eventSeq                       = 0  # keeps FIFO order among same (asn,priority)
+        self.eventsByTag                    = {} # indexed by uniqueTag, contains pending events
+        self.numCancelledEvents             = 0  # cancelled events still sitting in the heap
 
         # initialize parent class
         threading.Thread.__init__(self)
 
         self.name                           = 'SimEngine'
 
-    def destroy(self):
-        # destroy the propagation singleton
-        self.propagation.destroy()
+        # the singleton builds its own context (propagation, motes, topology
+        # and scheduler) around itself
+        if context:
+            self.context                    = context
+        else:
+            self.context                    = SimulationContext.SimulationContext(self.settings,runNum,engine=self)
+
+    def __getstate__(self):
+        ''' what a checkpoint saves, thread internals and locks are recreated by loadCheckpoint '''
+        return dict(
+            (k,v) for (k,v) in self.__dict__.items()
+            if not k.startswith('_Thread__') and not k.startswith('_Verbose__') and k not in ['dataLock','pauseSem']
+        )
 
+    def destroy(self):
         # destroy my own instance
         self._instance                      = None
         self._init                          = False
@@ -120,6 +195,10 @@ class SimEngine(threading.Thread):
 
             with self.dataLock:
 
+                # drop cancelled events from the head of the queue
+                while self.events and self.events[0][3] is None:
+                    self._popEvent()
+
                 # abort simulation when no more events
                 if not self.events:
                     log.info("end of simulation at ASN={0}".format(self.asn))
@@ -132,11 +211,10 @@ class SimEngine(threading.Thread):
                 self.asn = self.events[0][0]
 
                 # call callbacks at this ASN
-                while True:
-                    if self.events[0][0]!=self.asn:
-                        break
-                    (_,_,cb,_) = self.events.pop(0)
-                    cb()
+                while self.events and self.events[0][0]==self.asn:
+                    cb = self._popEvent()
+                    if cb:
+                        cb()
 
         # call the end callbacks
         for cb in self.endCb:
@@ -164,8 +242,9 @@ class SimEngine(threading.Thread):
     def scheduleAtAsn(self,asn,cb,uniqueTag=None,priority=0,exceptCurrentASN=True):
         ''' schedule an event at specific ASN '''
 
-        # make sure we are scheduling in the future
-        assert asn>self.asn
+        # make sure we are not scheduling in the past (an event at the
+        # current ASN runs after the events already due at this ASN)
+        assert asn>=self.asn
 
         # remove all events with same uniqueTag (the event will be rescheduled)
         if uniqueTag:
@@ -173,27 +252,61 @@ class SimEngine(threading.Thread):
 
         with self.dataLock:
 
-            # find correct index in schedule
-            i = 0
-            while i<len(self.events) and (self.events[i][0]<asn or (self.events[i][0]==asn and self.events[i][1]<=priority)):
-                i +=1
+            # add to schedule; the sequence number makes events with the
+            # same (asn,priority) fire in the order they were scheduled
+            event = [asn,priority,self.eventSeq,cb,uniqueTag]
+            heapq.heappush(self.events,event)
+            self.eventSeq += 1
 
-            # add to schedule
-            self.events.insert(i,(asn,priority,cb,uniqueTag))
+            # index by tag, so the event can be cancelled in constant time
+            if uniqueTag:
+                if uniqueTag not in self.eventsByTag:
+                    self.eventsByTag[uniqueTag] = []
+                self.eventsByTag[uniqueTag] += [event]
 
     def removeEvent(self,uniqueTag,exceptCurrentASN=True):
         with self.dataLock:
-            i = 0
-            while i<len(self.events):
-                if self.events[i][3]==uniqueTag and not (exceptCurrentASN and self.events[i][0]==self.asn):
-                    self.events.pop(i)
+            if uniqueTag not in self.eventsByTag:
+                return
+
+            keep = []
+            for event in self.eventsByTag[uniqueTag]:
+                if exceptCurrentASN and event[0]==self.asn:
+                    keep += [event]
                 else:
-                    i += 1
+                    # cancel; the event is dropped when it reaches the head of the heap
+                    event[3] = None
+                    self.numCancelledEvents += 1
+            if keep:
+                self.eventsByTag[uniqueTag] = keep
+            else:
+                del self.eventsByTag[uniqueTag]
+
+            # compact the heap when it is mostly made of cancelled events
+            if self.numCancelledEvents*2>len(self.events):
+                self.events[:] = [e for e in self.events if e[3] is not None]
+                heapq.heapify(self.events)
+                self.numCancelledEvents = 0
 
     def scheduleAtEnd(self,cb):
         with self.dataLock:
             self.endCb      += [cb]
 
+    #=== checkpoint
+
+    def saveCheckpoint(self,filename):
+        '''
+        Saves the complete state of the simulation (event queue, motes and
+        their schedules and queues, statistics and the state of the random
+        number generator) to a gzip'ed pickle. Call between two ASNs, e.g.
+        from the end-of-cycle statistics callback; see loadCheckpoint.
+        '''
+
+        with self.dataLock:
+            sys.setrecursionlimit(max(sys.getrecursionlimit(),10000))
+            with gzip.open(filename,'wb') as f:
+                cPickle.dump((random.getstate(),self.context),f,CHECKPOINT_PROTOCOL)
+
     #=== play/pause
 
     def play(self):
@@ -212,8 +325,38 @@ class SimEngine(threading.Thread):
     def getAsn(self):
         return self.asn
 
+    #=== locking
+
+    def newLock(self,reentrant=True):
+        '''
+        Returns the lock protecting simulation state. The GUI reads that state
+        from its own thread; headless runs are single-threaded and get a no-op
+        lock, so hot paths don't pay for locking.
+        '''
+        if not self.settings.gui:
+            return NullLock()
+        elif reentrant:
+            return threading.RLock()
+        else:
+            return threading.Lock()
+
     #======================== private =========================================
 
+    def _popEvent(self):
+        ''' pops the head of the event queue, returns its callback (None if cancelled) '''
+
+        (_,_,_,cb,uniqueTag) = event = heapq.heappop(self.events)
+
+        if cb is None:
+            self.numCancelledEvents -= 1
+        elif uniqueTag:
+            pending = self.eventsByTag[uniqueTag]
+            pending.remove(event)
+            if not pending:
+                del self.eventsByTag[uniqueTag]
+
+        return cb
+
     def _actionPauseSim(self):
         if not self.simPaused:
             self.simPaused = True
@@ -24,31 +24,21 @@ import os
 
 #============================ defines =========================================
 
-#============================ body ============================================
-
-class SimSettings(object):
-
-    #===== start singleton
-    _instance      = None
-    _init          = False
-
-    def __new__(cls, *args, **kwargs):
-        if not cls._instance:
-            cls._instance = super(SimSettings,cls).__new__(cls, *args, **kwargs)
-        return cls._instance
-    #===== end singleton
+# settings only read while a SimulationContext builds the network (topology,
+# motes, first schedule); a run resumed from a checkpoint keeps their saved values
+BUILD_SETTINGS = [
+    'numMotes','squareSide','topologyType','topologyFile','linkCutoffDistance','linkCutoffRssi',
+    'minRssi','pkPeriod','pkPeriodVar','numPacketsBurst','burstTimestamp',
+    'otfHousekeepingPeriod','sixtopHousekeepingPeriod','sixtopPdrThreshold','sixtopNoHousekeeping',
+    'slotDuration','slotframeLength','numChans','debugCells','vectorizedPropagation',
+    'schedulingPolicy','scheduleCache','scheduleCacheDir',
+]
 
-    def __init__(self,failIfNotInit=False,**kwargs):
+#============================ body ============================================
 
-        if failIfNotInit and not self._init:
-            raise EnvironmentError('SimSettings singleton not initialized.')
-
-        #===== start singleton
-        if self._init:
-            return
-        self._init = True
-        #===== end singleton
+class Settings(object):
 
+    def __init__(self,**kwargs):
         self.__dict__.update(kwargs)
         print "I accepted"
 
@@ -76,6 +66,32 @@ class SimSettings(object):
 
         return datafilename
 
+class SimSettings(Settings):
+    ''' Process-wide settings, for code that does not get a SimulationContext. '''
+
+    #===== start singleton
+    _instance      = None
+    _init          = False
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(SimSettings,cls).__new__(cls, *args, **kwargs)
+        return cls._instance
+    #===== end singleton
+
+    def __init__(self,failIfNotInit=False,**kwargs):
+
+        if failIfNotInit and not self._init:
+            raise EnvironmentError('SimSettings singleton not initialized.')
+
+        #===== start singleton
+        if self._init:
+            return
+        self._init = True
+        #===== end singleton
+
+        super(SimSettings,self).__init__(**kwargs)
+
     def destroy(self):
         self._instance       = None
         self._init           = False
@@ -21,10 +21,8 @@ log.addHandler(NullHandler())
 #============================ imports =========================================
 
 import SimEngine
-import SimSettings
 import os
 import csv
-import Scheduler
 
 #============================ defines =========================================
 
@@ -37,32 +35,42 @@ class SimStats(object):
     _init          = False
 
     def __new__(cls, *args, **kwargs):
+        if kwargs.get('context'):
+            # stats owned by a SimulationContext are not shared
+            return super(SimStats,cls).__new__(cls)
         if not cls._instance:
             cls._instance = super(SimStats,cls).__new__(cls, *args, **kwargs)
         return cls._instance
     #===== end singleton
 
-    def __init__(self,runNum):
+    def __init__(self,runNum,context=None):
 
-        #===== start singleton
-        if self._init:
-            return
-        self._init = True
-        #===== end singleton
+        if not context:
+
+            #===== start singleton
+            if self._init:
+                return
+            self._init = True
+            #===== end singleton
+
+            # the singleton collects statistics of the SimEngine singleton
+            context = SimEngine.SimEngine().context
 
         # store params
         self.runNum                         = runNum
 
         # local variables
-        self.engine                         = SimEngine.SimEngine()
-        self.settings                       = SimSettings.SimSettings()
-        self.schedules                      = Scheduler.Scheduler()
+        context.stats                       = self
+        self.engine                         = context.engine
+        self.settings                       = context.settings
+        self.schedules                      = context.scheduler
         self.Schedulefilename                  ="../bin/simData/schedulefile.csv"
         self.scheduleoutputfile                = open(self.Schedulefilename,"w")
 
         # stats
         self.stats                          = {}
         self.columnNames                    = []
+        self.numUpdatesWritten              = 0
 
         self.datafilename                   = []
 
@@ -88,6 +96,12 @@ class SimStats(object):
         )
 
 
+    def resumeRun(self,runNum):
+        ''' continue collecting statistics as run runNum, after a checkpoint was loaded and its settings updated '''
+        self.runNum                         = runNum
+        if self.runNum==0:
+            self._fileWriteHeader()
+
     def writingHeaders(self):
         cycle = int(self.engine.getAsn()/self.settings.slotframeLength)
         for mote in self.engine.motes:
@@ -126,6 +140,11 @@ class SimStats(object):
                     wtr.writerows([b])
 
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['scheduleoutputfile'] = None
+        return state
+
     def destroy(self):
         # destroy my own instance
         self._instance                      = None
@@ -166,6 +185,17 @@ class SimStats(object):
             )
         )'''
 
+        # write the cost of the reschedulings to output file
+        self._fileWriteStats(
+            dict(
+                {
+                    'runNum':              self.runNum,
+                    'cycle':               cycle,
+                }.items() +
+                self._collectSchedulerStats().items()
+            )
+        )
+
         # schedule next statistics collection
         self.engine.scheduleAtAsn(
             asn         = self.engine.getAsn()+self.settings.slotframeLength,
@@ -174,6 +204,10 @@ class SimStats(object):
             priority    = 10,
         )
 
+        # checkpoint at the end of the requested cycle
+        if cycle==self.settings.checkpointCycle:
+            self.engine.saveCheckpoint(SimEngine.getCheckpointFile(self.settings.checkpointFile,self.runNum))
+
     def _actionEnd(self):
         '''Called once at end of the simulation.'''
         self._fileWriteTopology()
@@ -201,30 +235,11 @@ class SimStats(object):
 
         # Note that this cannot count past schedule collisions which have been relocated by 6top
         # as this is called at the end of cycle
-        scheduleCollisions = 0
-        txCells = []
-        for mote in self.engine.motes:
-            for (ts,cell) in mote.schedule.items():
-                (ts,ch) = (ts,cell['ch'])
-                if cell['dir']==mote.DIR_TX:
-                    if (ts,ch) in txCells:
-                        scheduleCollisions += 1
-                    else:
-                        txCells += [(ts,ch)]
+        sharedTxCells      = self.engine.scheduleIndex.getSharedTxCells()
+        scheduleCollisions = sum([len(txs)-1 for txs in sharedTxCells.values()])
 
         # collect collided links
-        txLinks = {}
-        for mote in self.engine.motes:
-            for (ts,cell) in mote.schedule.items():
-                if cell['dir']==mote.DIR_TX:
-                    (ts,ch) = (ts,cell['ch'])
-                    (tx,rx) = (mote,cell['neighbor'])
-                    if (ts,ch) in txLinks:
-                        txLinks[(ts,ch)] += [(tx,rx)]
-                    else:
-                        txLinks[(ts,ch)]  = [(tx,rx)]
-
-        collidedLinks = [txLinks[(ts,ch)] for (ts,ch) in txLinks if len(txLinks[(ts,ch)])>=2]
+        collidedLinks = [[(tx,tx.schedule[ts]['neighbor']) for tx in txs] for ((ts,ch),txs) in sharedTxCells.items()]
 
         # compute the number of Tx in schedule collision cells
         collidedTxs = 0
@@ -234,17 +249,35 @@ class SimStats(object):
         # compute the number of effective collided Tx
         effectiveCollidedTxs = 0
         insufficientLength   = 0
+        canInterfere         = self.engine.propagation.canInterfere
         for links in collidedLinks:
             for (tx1,rx1) in links:
                 for (tx2,rx2) in links:
                     if tx1!=tx2 and rx1!=rx2:
                         # check whether interference from tx1 to rx2 is effective
-                        if tx1.getRSSI(rx2) > rx2.minRssi:
+                        if tx1 in canInterfere[rx2]:
                             effectiveCollidedTxs += 1
 
 
         return {'scheduleCollisions':scheduleCollisions, 'collidedTxs': collidedTxs, 'effectiveCollidedTxs': effectiveCollidedTxs}
 
+    def _collectSchedulerStats(self):
+
+        # the reschedulings run after the statistics of the slot they happen in,
+        # so count those done since the previous line was written
+        updates                = self.schedules.updates[self.numUpdatesWritten:]
+        self.numUpdatesWritten = len(self.schedules.updates)
+
+        durations              = [update['duration'] for update in updates]
+
+        return {
+            'numReschedulings':       len(updates),
+            'rescheduleDuration':     float(sum(durations)),
+            'maxRescheduleDuration':  float(max(durations+[0])),
+            'cellsAdded':             sum([update['cellsAdded'] for update in updates]),
+            'cellsRemoved':           sum([update['cellsRemoved'] for update in updates]),
+        }
+
     #=== writing to file
 
     def _fileWriteHeader(self):
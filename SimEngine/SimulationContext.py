@@ -0,0 +1,111 @@
+#!/usr/bin/python
+'''
+\brief Everything that makes up one simulation run.
+
+A SimulationContext owns the settings, engine, propagation model, schedule
+index, motes, topology, scheduler and statistics collector of a single run,
+and is handed to each of them. Several contexts can live in the same process, so
+replications can run back-to-back or side by side without tearing down
+process-wide singletons.
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('SimulationContext')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ imports =========================================
+
+import os
+
+import SimEngine
+import Propagation
+import Mote
+import Topology
+import Scheduler
+import ScheduleIndex
+import SimStats
+
+#============================ defines =========================================
+
+#============================ body ============================================
+
+class SimulationContext(object):
+
+    def __init__(self,settings,runNum=None,engine=None):
+        '''
+        \param settings The settings of this run (see SimSettings.Settings).
+        \param runNum   The number of this run.
+        \param engine   An engine created through the SimEngine singleton;
+                        the statistics collector is then left to the SimStats
+                        singleton.
+        '''
+
+        # store params
+        self.settings                       = settings
+        self.runNum                         = runNum
+
+        # local variables
+        self.stats                          = None
+        if engine:
+            self.engine                     = engine
+        else:
+            self.engine                     = SimEngine.SimEngine(runNum,context=self)
+
+        # create the run's components, the engine exposes them as well
+        if self.settings.vectorizedPropagation:
+            self.propagation                = Propagation.VectorPropagation(self)
+        else:
+            self.propagation                = Propagation.Propagation(self)
+        self.engine.propagation             = self.propagation
+        self.scheduleIndex                  = ScheduleIndex.ScheduleIndex()
+        self.engine.scheduleIndex           = self.scheduleIndex
+        self.motes                          = [Mote.Mote(id,self) for id in range(self.settings.numMotes)]
+        self.engine.motes                   = self.motes
+        self.topology                       = Topology.Topology(self.motes,self)
+        self.engine.topology                = self.topology
+        self.scheduler                      = Scheduler.Scheduler(self)
+        self.engine.scheduler               = self.scheduler
+
+        topologyFile                        = self._getTopologyFile()
+        if topologyFile and os.path.exists(topologyFile):
+            self.topology.importTopology(topologyFile)
+        else:
+            self.topology.createTopology()
+            if topologyFile:
+                self.topology.exportTopology(topologyFile)
+        self.propagation.loadTopology()
+
+        # run Scheduler, and keep the schedule up to date
+        self.scheduler.updateMoteSchedules()
+        self.scheduler.startUpdates()
+
+        # boot all motes
+        for mote in self.motes:
+            mote.boot()
+
+        # start collecting statistics
+        if not engine:
+            self.stats                      = SimStats.SimStats(runNum,context=self)
+
+    #======================== public ==========================================
+
+    def run(self):
+        ''' runs the simulation to completion, in the calling thread '''
+        self.engine.run()
+
+    #======================== private =========================================
+
+    def _getTopologyFile(self):
+        ''' settings.topologyFile, with the settings filled in '''
+        if not self.settings.topologyFile:
+            return None
+        topologyFile = self.settings.topologyFile.format(**self.settings.__dict__)
+        if not topologyFile.endswith('.npz'):
+            topologyFile += '.npz'
+        return topologyFile
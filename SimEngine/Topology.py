@@ -20,13 +20,70 @@ log.addHandler(NullHandler())
 
 #============================ imports =========================================
 
+import os
 import random
 import math
 
-import SimSettings
+import LinkTable
+import RoutingTree
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # topology built with Python loops, no Topology.rssiToPdrArray
 
 #============================ defines =========================================
 
+# rssi and pdr relationship obtained by experiment below
+# http://wsn.eecs.berkeley.edu/connectivity/?dataset=dust
+RSSI_PDR_TABLE = [
+    (-97,    0.0000), # this value is not from experiment
+    (-96,    0.1494),
+    (-95,    0.2340),
+    (-94,    0.4071),
+    #<-- 50% PDR is here, at RSSI=-93.6
+    (-93,    0.6359),
+    (-92,    0.6866),
+    (-91,    0.7476),
+    (-90,    0.8603),
+    (-89,    0.8702),
+    (-88,    0.9324),
+    (-87,    0.9427),
+    (-86,    0.9562),
+    (-85,    0.9611),
+    (-84,    0.9739),
+    (-83,    0.9745),
+    (-82,    0.9844),
+    (-81,    0.9854),
+    (-80,    0.9903),
+    (-79,    1.0000), # this value is not from experiment
+]
+
+# linear interpolation coefficients, indexed by floor(rssi)-MIN_TABLE_RSSI
+MIN_TABLE_RSSI = RSSI_PDR_TABLE[0][0]
+MAX_TABLE_RSSI = RSSI_PDR_TABLE[-1][0]
+PDR_LOW        = [pdr for (_,pdr) in RSSI_PDR_TABLE]
+PDR_SLOPE      = [high-low for (low,high) in zip(PDR_LOW[:-1],PDR_LOW[1:])]+[0.0]
+
+if numpy is not None:
+    _PDR_LOW   = numpy.array(PDR_LOW)
+    _PDR_SLOPE = numpy.array(PDR_SLOPE)
+
+#============================ helpers =========================================
+
+def _continueRandomStream():
+    ''' a numpy generator which continues the stream of the random module '''
+    (_,internalState,_) = random.getstate()
+    stream             = numpy.random.RandomState()
+    stream.set_state(('MT19937',numpy.array(internalState[:-1],dtype=numpy.uint32),internalState[-1]))
+    return stream
+
+def _endRandomStream(stream):
+    ''' move the random module past the numbers drawn from stream '''
+    (version,_,gaussNext) = random.getstate()
+    (_,key,pos,_,_)       = stream.get_state()
+    random.setstate((version,tuple(int(k) for k in key)+(int(pos),),gaussNext))
+
 #============================ body ============================================
 
 class Topology(object):
@@ -35,19 +92,28 @@ class Topology(object):
     PISTER_HACK_LOWER_SHIFT  = 40           # -40 dB
     SPEED_OF_LIGHT           = 299792458    # m/s
 
-    STABLE_RSSI              = -93.6        # dBm, corresponds to PDR = 0.5 (see rssiPdrTable below)
+    STABLE_RSSI              = -93.6        # dBm, corresponds to PDR = 0.5 (see RSSI_PDR_TABLE)
     STABLE_NEIGHBORS         = 0
     MAX_DISTANCE             = 60
+    NEIGHBOR_DISTANCE        = 100          # motes closer than this (see _computeDistance) are neighbors
+
+    TOPOLOGY_TYPES           = ['random','grid','line','clustered','poisson']
+    POISSON_CANDIDATES       = 30           # candidate locations tried around each active point
 
-    def __init__(self, motes):
+    def __init__(self, motes, context):
 
         # store params
         self.motes           = motes
+        self.motesById       = dict((m.id,m) for m in motes)
 
         self.neighbors       = []
 
         # local variables
-        self.settings        = SimSettings.SimSettings()
+        self.settings        = context.settings
+        self.grid            = {}                           # motes indexed by grid cell, see _gridCell
+        self.gridCellSide    = self.NEIGHBOR_DISTANCE/100.0 # in location units, see _computeDistance
+        self.sparseLinks     = (self.settings.linkCutoffDistance is not None) or (self.settings.linkCutoffRssi is not None)
+        self.routingTree     = None                         # built by getRoutingTree
 
 
 
@@ -60,6 +126,10 @@ class Topology(object):
         with enough RSSI.
         If the mote does not have STABLE_NEIGHBORS links with enough RSSI,
         reset the location of the mote.
+        When settings.linkCutoffDistance or settings.linkCutoffRssi is set, only
+        the links within those cutoffs are kept, in a LinkTable per mote.
+        Other settings.topologyType than 'random' place the motes in one pass
+        instead, see _createSyntheticTopology.
         '''
 
         # find DAG root
@@ -70,12 +140,23 @@ class Topology(object):
                 dagRoot = mote
         assert dagRoot
 
+        if self.settings.topologyType!='random':
+            self._createSyntheticTopology(dagRoot)
+            self._indexLocations()
+            return
+
         # put DAG root at center of area
         dagRoot.setLocation(
             x = self.settings.squareSide/2,
             y = self.settings.squareSide/2
         )
 
+        if numpy is not None:
+            # same topology, built on arrays
+            self._createTopologyArrays(dagRoot)
+            self._indexLocations()
+            return
+
         # reposition each mote until it is connected
         connectedMotes = [dagRoot]
         for mote in self.motes:
@@ -142,6 +223,12 @@ class Topology(object):
 
                     #mote_distances[mote]+=
 
+        # only keep the links within the cutoffs
+        if self.sparseLinks:
+            self._compactLinks()
+
+        self._indexLocations()
+
         # print topology information
 
         for mote in self.motes:
@@ -170,8 +257,455 @@ class Topology(object):
                 print "parent set {0} = {1} and length {2}".format(mote.id, [n.id for n in mote.parentSet], len(mote.parentSet))
                 print "links set {0} = {1}".format(mote.id, [n for n in mote.getTxCells()])
                 '''
+
+    def exportTopology(self,filename):
+        ''' save the locations, ranks and links of the motes to a .npz file '''
+
+        if numpy is None:
+            raise ImportError('saving a topology requires numpy')
+
+        motes      = sorted(self.motes,key=lambda m: m.id)
+        links      = []
+        for mote in motes:
+            for (neighborId,rssi) in sorted(mote.getRSSIs()):
+                neighbor = self.motesById[neighborId]
+                links   += [(mote.id,neighborId,rssi,mote.getPDR(neighbor),mote.getDistance(neighbor))]
+
+        # write to a temporary file first, several runs may share the file
+        tmpname    = '{0}.{1}.tmp'.format(filename,os.getpid())
+        with open(tmpname,'wb') as f:
+            numpy.savez_compressed(f,
+                ids          = numpy.array([m.id for m in motes]),
+                x            = numpy.array([m.getLocation()[0] for m in motes]),
+                y            = numpy.array([m.getLocation()[1] for m in motes]),
+                rank         = numpy.array([-1 if m.getMoteRank() is None else m.getMoteRank() for m in motes]),
+                linkSrc      = numpy.array([l[0] for l in links],dtype=int),
+                linkDst      = numpy.array([l[1] for l in links],dtype=int),
+                linkRssi     = numpy.array([l[2] for l in links],dtype=float),
+                linkPdr      = numpy.array([l[3] for l in links],dtype=float),
+                linkDistance = numpy.array([l[4] for l in links],dtype=float),
+            )
+        os.rename(tmpname,filename)
+
+    def importTopology(self,filename):
+        '''
+        Place the motes and set their links from a file written by
+        exportTopology, instead of creating a new topology. The link cutoffs
+        of this run apply to the links read.
+        '''
+
+        if numpy is None:
+            raise ImportError('loading a topology requires numpy')
+
+        # read each array once, an npz file decompresses it on every access
+        with numpy.load(filename) as npz:
+            data   = dict((name,npz[name]) for name in npz.files)
+        ids        = data['ids']
+        if sorted(ids.tolist())!=sorted([m.id for m in self.motes]):
+            raise ValueError('{0} holds a topology of {1} motes, not {2}'.format(filename,len(ids),len(self.motes)))
+
+        # place the motes
+        for (i,id) in enumerate(ids.tolist()):
+            mote   = self.motesById[id]
+            if mote.id==0:
+                mote.role_setDagRoot()
+            mote.setLocation(x=float(data['x'][i]),y=float(data['y'][i]))
+            mote.setMoteRank(None if data['rank'][i]==-1 else int(data['rank'][i]))
+
+        # set their links, stored by source mote
+        src        = data['linkSrc']
+        bounds     = numpy.searchsorted(src,ids)
+        ends       = numpy.searchsorted(src,ids,side='right')
+        for (i,id) in enumerate(ids.tolist()):
+            mote   = self.motesById[id]
+            rows   = slice(bounds[i],ends[i])
+            self._storeLinks(
+                mote,
+                data['linkDst'][rows],
+                data['linkRssi'][rows],
+                data['linkPdr'][rows],
+                data['linkDistance'][rows],
+            )
+
+        self._indexLocations()
+
+    def getRoutingTree(self):
+        ''' the routing tree of the motes, built on first use after their ranks or neighbors changed '''
+
+        if self.routingTree is None:
+            self.routingTree = RoutingTree.RoutingTree(self.motes)
+        return self.routingTree
+
+    def resetRoutingTree(self):
+        self.routingTree = None
+
+    def getNeighbors(self,mote):
+        ''' motes closer than NEIGHBOR_DISTANCE to that mote, with a link to it, by id '''
+
+        (cx,cy)   = self._gridCell(mote.x,mote.y)
+        neighbors = []
+        for gx in (cx-1,cx,cx+1):
+            for gy in (cy-1,cy,cy+1):
+                for m in self.grid.get((gx,gy),[]):
+                    if m!=mote and self._computeDistance(mote,m)<self.NEIGHBOR_DISTANCE and mote.hasLink(m):
+                        neighbors += [m]
+        return sorted(neighbors,key=lambda m: m.id)
+
     #======================== private =========================================
 
+    def _indexLocations(self):
+        ''' (re)build the grid after motes moved, and drop the neighbors they cached '''
+
+        self.grid = {}
+        for mote in self.motes:
+            self.grid.setdefault(self._gridCell(mote.x,mote.y),[]).append(mote)
+            mote.neighbors = None
+        self.resetRoutingTree()
+
+    def _gridCell(self,x,y):
+        ''' grid cell a location falls in, neighbors are at most one cell away '''
+
+        return (int(math.floor(x/self.gridCellSide)),int(math.floor(y/self.gridCellSide)))
+
+    def _createTopologyArrays(self,dagRoot):
+        '''
+        Same as createTopology (from the DAG root on), but the RSSI of all the
+        mote pairs is computed as an N x N array, and the distance and PDR one
+        row at a time. The random
+        numbers are drawn by numpy from the stream of the random module, in the
+        same order as createTopology, so both give the same topology.
+        '''
+
+        motes      = [dagRoot]+[m for m in self.motes if m!=dagRoot]
+        numMotes   = len(motes)
+        side       = self.settings.squareSide
+        x          = numpy.zeros(numMotes)
+        y          = numpy.zeros(numMotes)
+        x[0]       = dagRoot.x
+        y[0]       = dagRoot.y
+        gains      = numpy.array([m.antennaGain for m in motes],dtype=float)
+        rssi       = numpy.zeros((numMotes,numMotes))
+
+        # reposition each mote until it is connected to the motes placed before it
+        stream     = _continueRandomStream()
+        for i in range(1,numMotes):
+            connected = False
+            while not connected:
+                # pick a random location, and one Pister-hack draw per placed mote
+                draws     = stream.random_sample(2+i)
+                x[i]      = side*draws[0]
+                y[i]      = side*draws[1]
+                rssi[i,:i] = self._computeRSSIArray(
+                    motes[i],
+                    gains[:i],
+                    self._computeDistanceArray(x[i],y[i],x[:i],y[:i]),
+                    draws[2:],
+                )
+
+                # make sure it has at least STABLE_NEIGHBORS neighbors with sufficient RSSI
+                # or is connected to all the placed motes, when there are fewer
+                numStableNeighbors = int((rssi[i,:i]>self.STABLE_RSSI).sum())
+                if numStableNeighbors>=self.STABLE_NEIGHBORS or numStableNeighbors==i:
+                    connected = True
+        _endRandomStream(stream)
+
+        # links are symmetric
+        rssi      += rssi.T
+
+        # store in the motes, one row at a time
+        ids        = numpy.array([m.id for m in motes])
+        for (i,mote) in enumerate(motes):
+            mote.setLocation(x=float(x[i]),y=float(y[i]))
+        for (i,mote) in enumerate(motes):
+            distance   = self._computeDistanceArray(x[i],y[i],x,y)
+            self._storeLinks(mote,ids,rssi[i],self.rssiToPdrArray(rssi[i]),distance)
+            if mote!=dagRoot:
+                mote.setMoteRank(self._computeMoteRank(distance[0]))
+
+    def _createSyntheticTopology(self,dagRoot):
+        '''
+        Place the motes according to settings.topologyType, then compute the
+        links between all of them (or, with settings.linkCutoffDistance, only
+        between the motes within that distance).
+        The DAG root gets the first location, the other motes the following
+        ones by id. The layouts and links only draw from the random module, in
+        the same order with and without numpy, so they are the same for the
+        same seed.
+        '''
+
+        motes      = [dagRoot]+sorted([m for m in self.motes if m!=dagRoot],key=lambda m: m.id)
+        numMotes   = len(motes)
+        side       = float(self.settings.squareSide) # the layouts divide it, an int would floor
+        if   self.settings.topologyType=='grid':
+            locations = self._placeGrid(numMotes,side)
+        elif self.settings.topologyType=='line':
+            locations = self._placeLine(numMotes,side)
+        elif self.settings.topologyType=='clustered':
+            locations = self._placeClustered(numMotes,side)
+        elif self.settings.topologyType=='poisson':
+            locations = self._placePoisson(numMotes,side)
+        else:
+            raise ValueError('unknown topologyType {0}'.format(self.settings.topologyType))
+
+        for (mote,(x,y)) in zip(motes,locations):
+            mote.setLocation(x=x,y=y)
+            if mote!=dagRoot:
+                mote.setMoteRank(self._computeMoteRank(self._computeDistance(mote,dagRoot)))
+
+        if numpy is not None:
+            self._linkPairsArrays(motes)
+            return
+
+        # all the pairs, as createTopology does, or the same candidate pairs as
+        # _linkPairsArrays, so both draw the same random numbers
+        if self.settings.linkCutoffDistance is None:
+            pairs  = [(i,j) for i in range(numMotes) for j in range(i+1,numMotes)]
+        else:
+            pairs  = self._candidatePairs(motes)
+        for (i,j) in pairs:
+            (mote,m) = (motes[i],motes[j])
+            rssi     = self._computeRSSI(mote,m)
+            mote.setRSSI(m,rssi)
+            m.setRSSI(mote,rssi)
+            pdr      = self._computePDR(mote,m)
+            mote.setPDR(m,pdr)
+            m.setPDR(mote,pdr)
+            distance = self._computeDistance(mote,m)
+            mote.setDistance(m,distance)
+            m.setDistance(mote,distance)
+        if self.sparseLinks:
+            self._compactLinks()
+
+    def _placeGrid(self,numMotes,side):
+        ''' square grid filling the area, the locations closest to its center first '''
+
+        cols       = int(math.ceil(math.sqrt(numMotes)))
+        spacing    = side/cols
+        locations  = [((c+0.5)*spacing,(r+0.5)*spacing) for r in range(cols) for c in range(cols)]
+        locations.sort(key=lambda (x,y): ((x-side/2)**2+(y-side/2)**2,y,x))
+        return locations[:numMotes]
+
+    def _placeLine(self,numMotes,side):
+        ''' chain across the middle of the area, from its left edge '''
+
+        spacing    = side/max(numMotes-1,1)
+        return [(i*spacing,side/2) for i in range(numMotes)]
+
+    def _placeClustered(self,numMotes,side):
+        '''
+        About sqrt(numMotes) clusters, the first one at the center of the area
+        and the others uniformly placed; every mote but the cluster heads is
+        normally distributed around a random cluster head.
+        '''
+
+        numClusters = max(1,int(round(math.sqrt(numMotes))))
+        sigma       = side/(4*math.sqrt(numClusters))
+        heads       = [(side/2,side/2)]
+        heads      += [(side*random.random(),side*random.random()) for _ in range(1,min(numClusters,numMotes))]
+        locations   = list(heads)
+        for _ in range(len(heads),numMotes):
+            (hx,hy)     = random.choice(heads)
+            locations  += [(
+                min(max(random.gauss(hx,sigma),0.0),side),
+                min(max(random.gauss(hy,sigma),0.0),side),
+            )]
+        return locations
+
+    def _placePoisson(self,numMotes,side):
+        '''
+        Poisson-disc layout: no two motes closer than a radius, sampled around
+        the center of the area with Bridson's algorithm (a grid of cells which
+        hold at most one location keeps each test constant time). The radius
+        starts large enough to fill the area with about numMotes locations,
+        and shrinks until there are enough of them; the ones closest to the
+        center are kept.
+        '''
+
+        radius     = side*math.sqrt(0.5/numMotes)
+        while True:
+            locations = self._samplePoissonDisc(side,radius)
+            if len(locations)>=numMotes:
+                break
+            radius   *= 0.8
+        locations.sort(key=lambda (x,y): (x-side/2)**2+(y-side/2)**2)
+        return locations[:numMotes]
+
+    def _samplePoissonDisc(self,side,radius):
+        ''' all the locations Bridson's algorithm places at least radius apart '''
+
+        cellSide   = radius/math.sqrt(2)
+        minDistance2 = radius**2
+        cells      = {}
+        locations  = [(side/2,side/2)]
+        active     = [0]
+        cells[(int(side/2/cellSide),int(side/2/cellSide))] = 0
+        while active:
+            i          = random.randrange(len(active))
+            (ax,ay)    = locations[active[i]]
+            for _ in range(self.POISSON_CANDIDATES):
+                angle  = 2*math.pi*random.random()
+                dist   = radius*(1+random.random())
+                (x,y)  = (ax+dist*math.cos(angle),ay+dist*math.sin(angle))
+                if not (0<=x<side and 0<=y<side):
+                    continue
+                (cx,cy) = (int(x/cellSide),int(y/cellSide))
+                if not any(
+                        (locations[j][0]-x)**2+(locations[j][1]-y)**2<minDistance2
+                        for j in (cells.get((gx,gy)) for gx in range(cx-2,cx+3) for gy in range(cy-2,cy+3))
+                        if j is not None
+                    ):
+                    cells[(cx,cy)] = len(locations)
+                    active        += [len(locations)]
+                    locations     += [(x,y)]
+                    break
+            else:
+                # no room left around it
+                active[i] = active[-1]
+                active.pop()
+        return locations
+
+    def _linkPairsArrays(self,motes):
+        '''
+        Compute and store the links between placed motes, with arrays. With
+        settings.linkCutoffDistance, only the pairs in neighboring cells of a
+        grid of that side are considered, so the cost grows with the number
+        of links rather than with the square of the number of motes.
+        '''
+
+        ids        = numpy.array([m.id for m in motes])
+        x          = numpy.array([m.x for m in motes])
+        y          = numpy.array([m.y for m in motes])
+        gains      = numpy.array([m.antennaGain for m in motes],dtype=float)
+
+        # candidate pairs (i<j)
+        if self.settings.linkCutoffDistance is None:
+            (src,dst) = numpy.triu_indices(len(motes),1)
+        else:
+            pairs     = numpy.array(self._candidatePairs(motes),dtype=int).reshape(-1,2)
+            (src,dst) = (pairs[:,0],pairs[:,1])
+
+        # one Pister-hack draw per pair
+        stream     = _continueRandomStream()
+        draws      = stream.random_sample(len(src))
+        _endRandomStream(stream)
+        distance   = self._computeDistanceArray(x[src],y[src],x[dst],y[dst])
+        rssi       = numpy.zeros(len(src))
+        bounds     = numpy.searchsorted(src,numpy.arange(len(motes)+1))
+        for (i,mote) in enumerate(motes):
+            rows       = slice(bounds[i],bounds[i+1])
+            rssi[rows] = self._computeRSSIArray(mote,gains[dst[rows]],distance[rows],draws[rows])
+        pdr        = self.rssiToPdrArray(rssi)
+
+        # links are symmetric, store them by source mote
+        (src,dst)  = (numpy.concatenate([src,dst]),numpy.concatenate([dst,src]))
+        (rssi,pdr,distance) = (numpy.tile(rssi,2),numpy.tile(pdr,2),numpy.tile(distance,2))
+        order      = numpy.argsort(src,kind='mergesort')
+        bounds     = numpy.searchsorted(src[order],numpy.arange(len(motes)+1))
+        for (i,mote) in enumerate(motes):
+            rows       = order[bounds[i]:bounds[i+1]]
+            self._storeLinks(mote,ids[dst[rows]],rssi[rows],pdr[rows],distance[rows])
+
+    def _candidatePairs(self,motes):
+        '''
+        The pairs (i,j), i<j, of motes in the same or neighboring cells of a
+        grid of side settings.linkCutoffDistance, in increasing order. All the
+        pairs within that distance are among them.
+        '''
+
+        cellSide  = self.settings.linkCutoffDistance/100.0 # in location units, see _computeDistance
+        cells     = {}
+        for (i,mote) in enumerate(motes):
+            cells.setdefault((int(math.floor(mote.x/cellSide)),int(math.floor(mote.y/cellSide))),[]).append(i)
+        pairs     = []
+        for ((cx,cy),members) in cells.items():
+            others = []
+            for gx in (cx-1,cx,cx+1):
+                for gy in (cy-1,cy,cy+1):
+                    others += cells.get((gx,gy),[])
+            pairs += [(i,j) for i in members for j in others if i<j]
+        return sorted(pairs)
+
+    def _storeLinks(self,mote,neighborIds,rssi,pdr,distance):
+        '''
+        Store the links of a mote, given as arrays (which may include the mote
+        itself). The motes index these by neighbor, RSSI by neighbor id.
+        '''
+
+        keep       = self._keepLinks(rssi,distance) & (neighborIds!=mote.id)
+        cols       = numpy.flatnonzero(keep)
+        if self.sparseLinks:
+            cols       = cols[numpy.argsort(neighborIds[cols],kind='mergesort')]
+            mote.links = LinkTable.LinkTable(
+                neighborIds[cols].tolist(),
+                rssi[cols].tolist(),
+                pdr[cols].tolist(),
+                distance[cols].tolist(),
+            )
+        else:
+            neighbors  = [self.motesById[id] for id in neighborIds[cols].tolist()]
+            mote.RSSI.update(zip(neighborIds[cols].tolist(),rssi[cols].tolist()))
+            mote.PDR.update(zip(neighbors,pdr[cols].tolist()))
+            mote.DISTANCE.update(zip(neighbors,distance[cols].tolist()))
+
+    def _keepLinks(self,rssi,distance):
+        ''' which of the links with these RSSIs and distances are within the cutoffs '''
+
+        keep = numpy.ones(len(rssi),dtype=bool)
+        if self.settings.linkCutoffDistance is not None:
+            keep &= distance<self.settings.linkCutoffDistance
+        if self.settings.linkCutoffRssi is not None:
+            keep &= rssi>=self.settings.linkCutoffRssi
+        return keep
+
+    def _compactLinks(self):
+        ''' move the links within the cutoffs from the motes' dicts into LinkTables '''
+
+        for mote in self.motes:
+            links = []
+            for (neighborId,rssi) in mote.getRSSIs():
+                neighbor = self.motesById[neighborId]
+                distance = mote.getDistance(neighbor)
+                if self.settings.linkCutoffDistance is not None and not distance<self.settings.linkCutoffDistance:
+                    continue
+                if self.settings.linkCutoffRssi is not None and not rssi>=self.settings.linkCutoffRssi:
+                    continue
+                links += [(neighbor.id,rssi,mote.getPDR(neighbor),distance)]
+            links.sort()
+            mote.links = LinkTable.LinkTable(*[[link[k] for link in links] for k in range(4)])
+            mote.RSSI.clear()
+            mote.PDR.clear()
+            mote.DISTANCE.clear()
+
+    def _computeRSSIArray(self,mote,neighborGains,distance,draws):
+        '''
+        Same as _computeRSSI, from a mote to several neighbors at once, given
+        their antenna gains, distances and a uniform [0,1) draw for each.
+        '''
+
+        # sqrt and inverse of the free space path loss
+        fspl = (self.SPEED_OF_LIGHT/(4*math.pi*distance*self.TWO_DOT_FOUR_GHZ))
+
+        # simple friis equation in Pr=Pt+Gt+Gr+20log10(c/4piR)
+        with numpy.errstate(divide='ignore'):
+            pr = mote.txPower + mote.antennaGain + neighborGains + (20*numpy.log10(fspl))
+
+        # according to the receiver power (RSSI) we can apply the Pister hack model.
+        mu = pr-self.PISTER_HACK_LOWER_SHIFT/2 #chosing the "mean" value
+
+        # the receiver will receive the packet with an rssi uniformly distributed between friis and friis -40
+        rssi = mu + (-self.PISTER_HACK_LOWER_SHIFT/2 + self.PISTER_HACK_LOWER_SHIFT*draws)
+
+        # as _computeRSSI does, every link gets -29 dBm
+        return numpy.zeros(len(rssi))-29
+
+    def _computeDistanceArray(self,x1,y1,x2,y2):
+        ''' same as _computeDistance, between arrays of coordinates '''
+
+        # with an array exponent, numpy calls pow() as _computeDistance does
+        # rather than squaring, so both agree to the last bit
+        two = numpy.zeros(numpy.broadcast(x1,x2).shape)+2
+        return 100*numpy.sqrt(numpy.power(x1-x2,two)+numpy.power(y1-y2,two))
+
     def _computeRSSI(self,mote,neighbor):
         ''' computes RSSI between any two nodes (not only neighbors) according to the Pister-hack model.'''
 
@@ -203,50 +737,27 @@ class Topology(object):
 
     @classmethod
     def rssiToPdr(self,rssi):
-        '''
-        rssi and pdr relationship obtained by experiment below
-        http://wsn.eecs.berkeley.edu/connectivity/?dataset=dust
-        '''
+        ''' PDR at that RSSI, interpolated from RSSI_PDR_TABLE '''
 
-        rssiPdrTable    = {
-            -97:    0.0000, # this value is not from experiment
-            -96:    0.1494,
-            -95:    0.2340,
-            -94:    0.4071,
-            #<-- 50% PDR is here, at RSSI=-93.6
-            -93:    0.6359,
-            -92:    0.6866,
-            -91:    0.7476,
-            -90:    0.8603,
-            -89:    0.8702,
-            -88:    0.9324,
-            -87:    0.9427,
-            -86:    0.9562,
-            -85:    0.9611,
-            -84:    0.9739,
-            -83:    0.9745,
-            -82:    0.9844,
-            -81:    0.9854,
-            -80:    0.9903,
-            -79:    1.0000, # this value is not from experiment
-        }
-
-        minRssi         = min(rssiPdrTable.keys())
-        maxRssi         = max(rssiPdrTable.keys())
-
-        if   rssi<minRssi:
-            pdr         = 0.0
-        elif rssi>maxRssi:
-            pdr         = 1.0
+        if   rssi<MIN_TABLE_RSSI:
+            return 0.0
+        elif rssi>MAX_TABLE_RSSI:
+            return 1.0
         else:
             floorRssi   = int(math.floor(rssi))
-            pdrLow      = rssiPdrTable[floorRssi]
-            pdrHigh     = rssiPdrTable[floorRssi+1]
-            pdr         = (pdrHigh-pdrLow)*(rssi-float(floorRssi))+pdrLow # linear interpolation
-
-        assert pdr>=0.0
-        assert pdr<=1.0
+            i           = floorRssi-MIN_TABLE_RSSI
+            return PDR_SLOPE[i]*(rssi-float(floorRssi))+PDR_LOW[i] # linear interpolation
 
+    @classmethod
+    def rssiToPdrArray(self,rssi):
+        ''' same as rssiToPdr, for a numpy array of RSSIs '''
+
+        rssi            = numpy.asarray(rssi,dtype=float)
+        floorRssi       = numpy.floor(numpy.clip(rssi,MIN_TABLE_RSSI,MAX_TABLE_RSSI))
+        i               = (floorRssi-MIN_TABLE_RSSI).astype(int)
+        pdr             = _PDR_SLOPE[i]*(rssi-floorRssi)+_PDR_LOW[i] # linear interpolation
+        pdr[rssi<MIN_TABLE_RSSI] = 0.0
+        pdr[rssi>MAX_TABLE_RSSI] = 1.0
         return pdr
 
     def _computeDistance(self,mote,neighbor):
@@ -267,8 +778,8 @@ class Topology(object):
 #============================ main ============================================
 
 def main():
-    import Mote
     import SimSettings
+    import SimulationContext
 
     NOTVISITED     = 'notVisited'
     MARKED         = 'marked'
@@ -289,9 +800,8 @@ def main():
         settings.slotDuration              = 0.010
         settings.sixtopNoHousekeeping      = 0
         settings.numPacketsBurst           = None
-        motes                              = [Mote.Mote(id) for id in range(settings.numMotes)]
-        topology                           = Topology(motes)
-        topology.createTopology()
+        context                            = SimulationContext.SimulationContext(settings)
+        motes                              = context.motes
 
         # print stats
         hopVal    = {}
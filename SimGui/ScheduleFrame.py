@@ -28,8 +28,6 @@ from SimEngine             import SimEngine, \
                                   LinkSchedules
 
 
-from Scheduler import Scheduler
-
 from Link import Link
 from TopologyFrame import TopologyFrame
 from collections import Counter
@@ -57,7 +55,6 @@ class ScheduleFrame(Tkinter.Frame):
 
         # store params
         self.guiParent       = guiParent
-        self.scheduler            = Scheduler()
 
         self.update_period   =1000
 
@@ -158,15 +155,10 @@ class ScheduleFrame(Tkinter.Frame):
                 else:
                     continue
 
-        '''
-        for m in self.engine.motes:
-            for (ts,ch,_) in m.getTxCells():
-                color = self.schedule.itemcget(self.cells[ts][ch], "fill")
-                if not color:
-                    self.schedule.itemconfig(self.cells[ts][ch], fill=self.COLOR_OK)
-                else:
-                    self.schedule.itemconfig(self.cells[ts][ch], fill=self.COLOR_ERROR)
-        '''
+        # color installed cells in which several motes transmit
+        for (ts,ch) in self.engine.scheduleIndex.getSharedTxCells():
+            self.schedule.itemconfig(self.cells[ts][ch], fill=self.COLOR_ERROR)
+
         # color selected mote's cells
         mote = self.guiParent.selectedMote
         if mote:
@@ -28,7 +28,6 @@ from SimEngine import SimEngine, \
                       SimSettings, \
                       Mote, \
                       LinkSchedules
-from Scheduler import Scheduler
 #============================ defines =========================================
 
 #============================ body ============================================
@@ -53,7 +52,6 @@ class TopologyFrame(Tkinter.Frame):
 
         self.links      = {}
         self.linksavailable = []
-        self.scheduler                      = Scheduler()
         #self.neighbor = Mote.neighbor;
 
         # initialize the parent class
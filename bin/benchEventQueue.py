@@ -0,0 +1,170 @@
+#!/usr/bin/python
+'''
+\brief Benchmark of the SimEngine event queue.
+
+Compares the number of events per second the engine can schedule and fire
+against the original sorted-list queue, for several queue sizes. The workload
+mimics motes: every pending event reschedules itself (with its uniqueTag)
+a random number of slots into the future when it fires.
+
+Use '--help' for a list of options.
+'''
+
+#============================ adjust path =====================================
+
+import os
+import sys
+if __name__=='__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..'))
+
+#============================ imports =========================================
+
+import time
+import random
+import argparse
+import threading
+
+from SimEngine     import SimEngine
+
+#============================ defines =========================================
+
+SLOTFRAME_LENGTH = 101
+
+#============================ helpers =========================================
+
+class BenchSettings(object):
+    slotDuration     = 0.010
+
+class ListEngine(object):
+    ''' the original sorted-list event queue, kept here as a reference '''
+
+    def __init__(self):
+        self.dataLock    = threading.RLock()
+        self.settings    = BenchSettings()
+        self.asn         = 0
+        self.events      = []
+
+    def step(self):
+        self.asn = self.events[0][0]
+        while self.events and self.events[0][0]==self.asn:
+            (_,_,cb,_) = self.events.pop(0)
+            cb()
+
+    def scheduleAtAsn(self,asn,cb,uniqueTag=None,priority=0,exceptCurrentASN=True):
+        assert asn>self.asn
+        if uniqueTag:
+            self.removeEvent(uniqueTag,exceptCurrentASN)
+        with self.dataLock:
+            i = 0
+            while i<len(self.events) and (self.events[i][0]<asn or (self.events[i][0]==asn and self.events[i][1]<=priority)):
+                i +=1
+            self.events.insert(i,(asn,priority,cb,uniqueTag))
+
+    def removeEvent(self,uniqueTag,exceptCurrentASN=True):
+        with self.dataLock:
+            i = 0
+            while i<len(self.events):
+                if self.events[i][3]==uniqueTag and not (exceptCurrentASN and self.events[i][0]==self.asn):
+                    self.events.pop(i)
+                else:
+                    i += 1
+
+class HeapEngine(SimEngine.SimEngine):
+    ''' the SimEngine event queue, without motes, topology or scheduler '''
+
+    _instance      = None
+    _init          = False
+
+    def __init__(self):
+        self.dataLock    = threading.RLock()
+        self.settings    = BenchSettings()
+        self.asn         = 0
+        self.events      = []
+        self.eventSeq    = 0
+        self.eventsByTag = {}
+        self.numCancelledEvents = 0
+
+    def step(self):
+        while self.events[0][3] is None:
+            self._popEvent()
+        self.asn = self.events[0][0]
+        while self.events and self.events[0][0]==self.asn:
+            cb = self._popEvent()
+            if cb:
+                cb()
+
+def fillQueue(engine,numEvents,tagged,fired):
+    ''' schedule numEvents self-rescheduling events '''
+
+    def makeCb(i):
+        tag = (i,'bench') if tagged else None
+        def cb():
+            fired[0] += 1
+            engine.scheduleAtAsn(
+                asn         = engine.asn+random.randint(1,2*SLOTFRAME_LENGTH),
+                cb          = cb,
+                uniqueTag   = tag,
+                priority    = i%6,
+            )
+        return (cb,tag)
+
+    for i in range(numEvents):
+        (cb,tag) = makeCb(i)
+        engine.scheduleAtAsn(
+            asn         = 1+random.randint(0,2*SLOTFRAME_LENGTH),
+            cb          = cb,
+            uniqueTag   = tag,
+            priority    = i%6,
+        )
+
+def measure(engineClass,numEvents,numFired,tagged):
+    random.seed(0)
+    engine  = engineClass()
+    fired   = [0]
+    fillQueue(engine,numEvents,tagged,fired)
+    start   = time.time()
+    while fired[0]<numFired:
+        engine.step()
+    return fired[0]/(time.time()-start)
+
+def parseCliOptions():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument( '--numEvents',
+        dest       = 'numEvents',
+        nargs      = '+',
+        type       = int,
+        default    = [500,2000,8000],
+        help       = 'Number of events pending in the queue.',
+    )
+    parser.add_argument( '--numFired',
+        dest       = 'numFired',
+        type       = int,
+        default    = 5000,
+        help       = 'Number of events to fire per measurement.',
+    )
+    parser.add_argument('--untagged',
+        dest       = 'untagged',
+        action     = 'store_true',
+        default    = False,
+        help       = 'Schedule events without a uniqueTag.',
+    )
+
+    options        = parser.parse_args()
+
+    return options.__dict__
+
+#============================ main ============================================
+
+def main():
+    options = parseCliOptions()
+
+    print '{0:>10} {1:>14} {2:>14} {3:>8}'.format('numEvents','list (ev/s)','heap (ev/s)','speedup')
+    for numEvents in options['numEvents']:
+        listRate = measure(ListEngine,numEvents,options['numFired'],not options['untagged'])
+        heapRate = measure(HeapEngine,numEvents,options['numFired'],not options['untagged'])
+        print '{0:>10} {1:>14.0f} {2:>14.0f} {3:>7.1f}x'.format(numEvents,listRate,heapRate,heapRate/listRate)
+
+if __name__=="__main__":
+    main()
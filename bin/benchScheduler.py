@@ -0,0 +1,171 @@
+#!/usr/bin/python
+'''
+\brief Benchmark of the centralized Scheduler.
+
+Compares the time the Scheduler takes to schedule a set of links against the
+original implementation, for several numbers of links, and checks that both
+give the same slotframe. The links are those of a random routing tree, each
+with a random number of packets to send.
+
+Use '--help' for a list of options.
+'''
+
+#============================ adjust path =====================================
+
+import os
+import sys
+if __name__=='__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..'))
+
+#============================ imports =========================================
+
+import time
+import random
+import argparse
+
+from SimEngine     import Scheduler
+from SimEngine     import Link
+
+#============================ helpers =========================================
+
+class BenchSettings(object):
+    slotframeLength  = 101
+    numChans         = 16
+    schedulingPolicy = 'demand'
+
+class BenchContext(object):
+    engine           = None
+    settings         = BenchSettings()
+
+class ListLink(Link.Link):
+    ''' the original link, with its compartible links in a list '''
+
+    def __init__(self,node,timesToschedule,id):
+        Link.Link.__init__(self,node,timesToschedule,id)
+        self.compartibleLinks = []
+
+    def addCompartibleLink(self,link):
+        self.compartibleLinks.append(link)
+
+    def isCompartible(self,link):
+        return any(l == link for l in self.compartibleLinks)
+
+class ListScheduler(Scheduler.Scheduler):
+    '''
+    the original Scheduler, kept here as a reference (but without running
+    past the last timeslot when all its channels are busy)
+    '''
+
+    def generateCompartibleLinks(self,linksList):
+        for link1 in linksList:
+            for link2 in linksList:
+                if not link1.sharesNode(link2):
+                    link1.addCompartibleLink(link2)
+        return linksList
+
+    def chooseNextLink(self,linksList):
+        linksList.sort(key=lambda x:(x.timesToSchedule,-x.timesScheduledAlready),reverse=True)
+        return linksList[0]
+
+    def isConstraints(self,link,timeSlot):
+        singleSlot=[row[timeSlot] for row in self.slotFrame]
+        if any(x==link for x in singleSlot):
+            return True
+        for link1 in singleSlot:
+            if link1==None:
+                continue
+            if not link.isCompartible(link1):
+                return True
+        return False
+
+    def schedule(self,linksList):
+        for i in range(self.channels):
+            for j in range(self.timeslots):
+                self.slotFrame[i][j] = None
+        linksList = self.generateCompartibleLinks(linksList)
+        linksListCopy = linksList[:]
+        while(len(linksListCopy)>0):
+            cur_link = self.chooseNextLink(linksListCopy)
+            channelOffset,timeSlot =0,0
+            while(timeSlot<self.timeslots):
+                if channelOffset==self.channels:
+                    timeSlot+=1
+                    channelOffset=0
+                    continue
+                if not self.slotFrame[channelOffset][timeSlot] == None:
+                    channelOffset+=1
+                    continue
+                if not self.isConstraints(cur_link,timeSlot):
+                    self.slotFrame[channelOffset][timeSlot]=cur_link
+                    break
+                else:
+                    timeSlot+=1
+                    channelOffset=0
+                    continue
+            cur_link.reduceTimeToSchedule()
+            if cur_link.timesToSchedule==0:
+                del linksListCopy[linksListCopy.index(cur_link)]
+        linksdict ={}
+        for ts in range(self.timeslots):
+            for j in range(self.channels):
+                key = random.randint(0,self.channels-1)
+                while linksdict.has_key(key):
+                    key = random.randint(0,self.channels-1)
+                linksdict[key] =self.slotFrame[j][ts]
+            for j in range(self.channels):
+                self.slotFrame[j][ts]=None
+            for key, value in linksdict.items():
+                self.slotFrame[key][ts]=value
+            linksdict.clear()
+        return self.slotFrame
+
+def createLinks(numLinks,maxDemand):
+    ''' ((child,parent),packets) of a random routing tree '''
+    random.seed(0)
+    return [((id,random.randint(0,id-1)),random.randint(1,maxDemand)) for id in range(1,numLinks+1)]
+
+def measure(schedulerClass,linkClass,links):
+    linksList = [linkClass(nodes,packets,i+1) for (i,(nodes,packets)) in enumerate(links)]
+    scheduler = schedulerClass(BenchContext())
+    random.seed(0)
+    start     = time.time()
+    slotFrame = scheduler.schedule(linksList)
+    duration  = time.time()-start
+    return (duration,[[None if link is None else link.id for link in row] for row in slotFrame])
+
+def parseCliOptions():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument( '--numLinks',
+        dest       = 'numLinks',
+        nargs      = '+',
+        type       = int,
+        default    = [100,300,1000],
+        help       = 'Number of links to schedule.',
+    )
+    parser.add_argument( '--maxDemand',
+        dest       = 'maxDemand',
+        type       = int,
+        default    = 3,
+        help       = 'Maximum number of packets per link.',
+    )
+
+    options        = parser.parse_args()
+
+    return options.__dict__
+
+#============================ main ============================================
+
+def main():
+    options = parseCliOptions()
+
+    print '{0:>10} {1:>12} {2:>12} {3:>8} {4:>6}'.format('numLinks','list (s)','new (s)','speedup','same')
+    for numLinks in options['numLinks']:
+        links                 = createLinks(numLinks,options['maxDemand'])
+        (listTime,listFrame)  = measure(ListScheduler,ListLink,links)
+        (newTime,newFrame)    = measure(Scheduler.Scheduler,Link.Link,links)
+        print '{0:>10} {1:>12.3f} {2:>12.3f} {3:>7.1f}x {4:>6}'.format(numLinks,listTime,newTime,listTime/newTime,str(listFrame==newFrame))
+
+if __name__=="__main__":
+    main()
@@ -37,9 +37,11 @@ import logging.config
 import argparse
 import threading
 
-from SimEngine     import SimEngine,   \
-                          SimSettings, \
-                          SimStats
+from SimEngine     import SimEngine,         \
+                          SimSettings,       \
+                          SimStats,          \
+                          SimulationContext, \
+                          Topology
 from SimGui        import SimGui
 
 #============================ defines =========================================
@@ -80,6 +82,30 @@ def parseCliOptions():
         default    = 'simData',
         help       = '[simulation] Simulation log directory.',
     )
+    parser.add_argument('--debugCells',
+        dest       = 'debugCells',
+        action     = 'store_true',
+        default    = False,
+        help       = '[simulation] Count interference and lock-on events in each cell.',
+    )
+    parser.add_argument( '--checkpointCycle',
+        dest       = 'checkpointCycle',
+        type       = int,
+        default    = None,
+        help       = '[simulation] Save the run at the end of this cycle.',
+    )
+    parser.add_argument('--checkpointFile',
+        dest       = 'checkpointFile',
+        type       = str,
+        default    = 'checkpoint.pkl.gz',
+        help       = '[simulation] File the runs are saved to, with the run number added (e.g. checkpoint_run0.pkl.gz).',
+    )
+    parser.add_argument('--resumeFrom',
+        dest       = 'resumeFrom',
+        type       = str,
+        default    = None,
+        help       = '[simulation] Continue each run from this checkpoint file, with the given parameters. The checkpoint of the same run (e.g. checkpoint_run1.pkl.gz for checkpoint.pkl.gz) is used when it exists. Parameters used only when the network is built (SimSettings.BUILD_SETTINGS, e.g. numMotes, squareSide, pkPeriod, slotframeLength) keep their checkpointed value, whatever is given here.',
+    )
     # topology
     parser.add_argument( '--numMotes',
         dest       = 'numMotes',
@@ -94,6 +120,19 @@ def parseCliOptions():
         default    = 2.000,
         help       = '[topology] Side of the deployment area (km).',
     )
+    parser.add_argument('--topologyType',
+        dest       = 'topologyType',
+        type       = str,
+        choices    = Topology.Topology.TOPOLOGY_TYPES,
+        default    = 'random',
+        help       = '[topology] Layout of the motes: random locations (retried until connected), a grid, a line, clusters or a Poisson-disc layout, each with the DAG root first. Use with --linkCutoffDistance for large networks.',
+    )
+    parser.add_argument('--topologyFile',
+        dest       = 'topologyFile',
+        type       = str,
+        default    = None,
+        help       = '[topology] Load the topology from this .npz file (needs numpy), or save the topology created to it if it does not exist yet. Settings can be used in the name (e.g. topo_{numMotes}_{squareSide}.npz), so every combination of a sweep gets its own file and every run of it the same topology.',
+    )
     # app
     parser.add_argument( '--pkPeriod',
         dest       = 'pkPeriod',
@@ -170,6 +209,32 @@ def parseCliOptions():
         default    = 0,
         help       = '[6top] 1 to remove random cell, not worst.',
     )
+    # scheduler
+    parser.add_argument('--schedulerUpdatePeriod',
+        dest       = 'schedulerUpdatePeriod',
+        type       = int,
+        default    = 10000,
+        help       = '[scheduler] Slots between two updates of the centralized schedule, for the packets each mote queued since the previous one (0 to schedule once).',
+    )
+    parser.add_argument('--schedulingPolicy',
+        dest       = 'schedulingPolicy',
+        type       = str,
+        choices    = ['demand','tasa'],
+        default    = 'demand',
+        help       = '[scheduler] Order in which the centralized scheduler places cells: the links with the most packets first (demand), or following the packets along the routing tree from the slot they are generated in, so they reach the DAG root within a slotframe (tasa).',
+    )
+    parser.add_argument('--scheduleCache',
+        dest       = 'scheduleCache',
+        action     = 'store_true',
+        default    = False,
+        help       = '[scheduler] Reuse the schedule computed by an earlier run of this process for the same routing tree and packets to send (the last 16 are kept).',
+    )
+    parser.add_argument('--scheduleCacheDir',
+        dest       = 'scheduleCacheDir',
+        type       = str,
+        default    = None,
+        help       = '[scheduler] Keep the schedules computed in this directory, and reuse the ones of earlier simulations (e.g. the other runs of a sweep over OTF or 6top parameters).',
+    )
     # tsch
     parser.add_argument( '--slotDuration',
         dest       = 'slotDuration',
@@ -209,6 +274,24 @@ def parseCliOptions():
         default    = 0,
         help       = '[phy] Disable interference model.',
     )
+    parser.add_argument( '--linkCutoffDistance',
+        dest       = 'linkCutoffDistance',
+        type       = float,
+        default    = None,
+        help       = '[phy] Only keep the links shorter than this (same unit as the neighbor distance, 100), to save memory.',
+    )
+    parser.add_argument( '--linkCutoffRssi',
+        dest       = 'linkCutoffRssi',
+        type       = float,
+        default    = None,
+        help       = '[phy] Only keep the links with at least this RSSI (dBm), to save memory.',
+    )
+    parser.add_argument('--vectorizedPropagation',
+        dest       = 'vectorizedPropagation',
+        action     = 'store_true',
+        default    = False,
+        help       = '[phy] Compute the receptions of a slot with numpy (same results, faster for large networks).',
+    )
 
     options        = parser.parse_args()
 
@@ -256,23 +339,56 @@ def runSims(options):
             )
             printOrLog(simParam,output)
 
-            # create singletons
-            settings         = SimSettings.SimSettings(**simParam)
-            settings.setStartTime(runStartTime)
-            settings.setCombinationKeys(combinationKeys)
-            simengine        = SimEngine.SimEngine(runNum)
-            simstats         = SimStats.SimStats(runNum)
-
-            # start simulation run
-            simengine.start()
-
-            # wait for simulation run to end
-            simengine.join()
-
-            # destroy singletons
-            simstats.destroy()
-            simengine.destroy()
-            settings.destroy()
+            if simParam['gui']:
+
+                # create singletons, so the GUI can find them
+                settings         = SimSettings.SimSettings(**simParam)
+                settings.setStartTime(runStartTime)
+                settings.setCombinationKeys(combinationKeys)
+                simengine        = SimEngine.SimEngine(runNum)
+                simstats         = SimStats.SimStats(runNum)
+
+                # start simulation run
+                simengine.start()
+
+                # wait for simulation run to end
+                simengine.join()
+
+                # destroy singletons
+                simstats.destroy()
+                simengine.destroy()
+                settings.destroy()
+
+            elif simParam['resumeFrom']:
+
+                # fork the checkpointed run with this run's parameters, from the
+                # checkpoint of the same run if there is one
+                checkpointFile   = SimEngine.getCheckpointFile(simParam['resumeFrom'],runNum)
+                if not os.path.exists(checkpointFile):
+                    checkpointFile = simParam['resumeFrom']
+                context          = SimEngine.loadCheckpoint(checkpointFile)
+                context.settings.__dict__.update(
+                    (k,v) for (k,v) in simParam.items() if k not in SimSettings.BUILD_SETTINGS
+                )
+                context.settings.setStartTime(runStartTime)
+                context.settings.setCombinationKeys(combinationKeys)
+                context.runNum   = runNum
+                context.engine.runNum = runNum
+                context.stats.resumeRun(runNum)
+
+                # run it in this thread
+                context.run()
+
+            else:
+
+                # create the run
+                settings         = SimSettings.Settings(**simParam)
+                settings.setStartTime(runStartTime)
+                settings.setCombinationKeys(combinationKeys)
+                context          = SimulationContext.SimulationContext(settings,runNum)
+
+                # run it in this thread
+                context.run()
 
         # print
         output  = 'simulation ended after {0:.0f}s.'.format(time.time()-simStartTime)
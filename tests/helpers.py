@@ -0,0 +1,114 @@
+#!/usr/bin/python
+'''
+\brief Helpers of the tests: settings and runs of small simulations.
+
+Run the tests from the root of the repository with
+'python -m unittest discover tests'.
+'''
+
+#============================ adjust path =====================================
+
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+#============================ imports =========================================
+
+import time
+import random
+import shutil
+import tempfile
+import unittest
+
+from SimEngine import SimSettings, \
+                      SimulationContext
+
+#============================ defines =========================================
+
+# the defaults of bin/runSimOneCPU.py, for a single run of a small network
+SETTINGS = dict(
+    gui                      = False,
+    cpuID                    = None,
+    numRuns                  = 1,
+    numCyclesPerRun          = 5,
+    simDataDir               = 'simData',
+    debugCells               = False,
+    checkpointCycle          = None,
+    checkpointFile           = None,
+    resumeFrom               = None,
+    numMotes                 = 20,
+    squareSide               = 2.0,
+    topologyType             = 'random',
+    topologyFile             = None,
+    pkPeriod                 = 1.0,
+    pkPeriodVar              = 0.05,
+    burstTimestamp           = 20,
+    numPacketsBurst          = None,
+    dioPeriod                = 1.0,
+    otfThreshold             = 1,
+    otfHousekeepingPeriod    = 5.0,
+    sixtopHousekeepingPeriod = 1.0,
+    sixtopPdrThreshold       = 1.5,
+    sixtopNoHousekeeping     = 0,
+    sixtopNoRemoveWorstCell  = 0,
+    schedulerUpdatePeriod    = 10000,
+    schedulingPolicy         = 'demand',
+    scheduleCache            = False,
+    scheduleCacheDir         = None,
+    slotDuration             = 0.1,
+    slotLength               = 3000,
+    slotframeLength          = 101,
+    numChans                 = 16,
+    minRssi                  = -97,
+    noInterference           = 0,
+    linkCutoffDistance       = None,
+    linkCutoffRssi           = None,
+    vectorizedPropagation    = False,
+)
+
+#============================ helpers =========================================
+
+def getMoteSchedules(context):
+    ''' (ts,ch,dir,neighbor id,numTx,numTxAck,numRx) of the cells of each mote, by id '''
+    return [
+        sorted(
+            (ts,cell['ch'],cell['dir'],cell['neighbor'].id,cell['numTx'],cell['numTxAck'],cell['numRx'])
+            for (ts,cell) in mote.schedule.items()
+        )
+        for mote in context.motes
+    ]
+
+def getMoteStats(context):
+    ''' the statistics of each mote, by id '''
+    return [sorted(mote.getMoteStats().items()) for mote in context.motes]
+
+#============================ body ============================================
+
+class SimulationTestCase(unittest.TestCase):
+    '''
+    Runs each test in a scratch directory, which is where the motes and the
+    statistics write their files, and keeps the runs from printing.
+    '''
+
+    def setUp(self):
+        self.cwd    = os.getcwd()
+        self.stdout = sys.stdout
+        self.tmpDir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpDir,'bin','simData'))
+        os.chdir(os.path.join(self.tmpDir,'bin'))
+        sys.stdout  = open(os.devnull,'w')
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stdout  = self.stdout
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpDir)
+
+    def createContext(self,seed,**settings):
+        ''' a run with the given settings on top of SETTINGS, from the given seed '''
+        random.seed(seed)
+        settings = SimSettings.Settings(**dict(SETTINGS,**settings))
+        settings.setStartTime(time.time())
+        settings.setCombinationKeys([])
+        return SimulationContext.SimulationContext(settings,0)
@@ -0,0 +1,40 @@
+#!/usr/bin/python
+'''
+\brief Tests of saving a run to a checkpoint and resuming it.
+'''
+
+#============================ imports =========================================
+
+import random
+import unittest
+
+import helpers
+
+from SimEngine import SimEngine
+
+#============================ body ============================================
+
+class TestCheckpoint(helpers.SimulationTestCase):
+
+    SETTINGS = dict(numMotes=40,squareSide=3.0,numCyclesPerRun=8,numPacketsBurst=5)
+
+    def _runToEnd(self,context):
+        context.run()
+        return (helpers.getMoteSchedules(context),helpers.getMoteStats(context),random.getstate())
+
+    def test_resumeReproducesRun(self):
+        ''' a run resumed from a checkpoint ends as the same run left uninterrupted '''
+
+        (schedules,stats,randomState) = self._runToEnd(self.createContext(3,**self.SETTINGS))
+
+        self._runToEnd(self.createContext(3,checkpointCycle=4,checkpointFile='checkpoint.pkl.gz',**self.SETTINGS))
+        context = SimEngine.loadCheckpoint(SimEngine.getCheckpointFile('checkpoint.pkl.gz',0))
+        self.assertEqual(context.engine.getAsn(),5*context.settings.slotframeLength-1)
+
+        (resumedSchedules,resumedStats,resumedRandomState) = self._runToEnd(context)
+        self.assertEqual(resumedSchedules,schedules)
+        self.assertEqual(resumedStats,stats)
+        self.assertEqual(resumedRandomState,randomState)
+
+if __name__=='__main__':
+    unittest.main()
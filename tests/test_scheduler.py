@@ -0,0 +1,75 @@
+#!/usr/bin/python
+'''
+\brief Tests of the centralized Scheduler.
+'''
+
+#============================ imports =========================================
+
+import unittest
+
+import helpers
+
+from SimEngine import Scheduler
+
+#============================ body ============================================
+
+class TestScheduleCache(helpers.SimulationTestCase):
+
+    def setUp(self):
+        super(TestScheduleCache,self).setUp()
+        Scheduler._scheduleCache.clear()
+
+    def tearDown(self):
+        Scheduler._scheduleCache.clear()
+        super(TestScheduleCache,self).tearDown()
+
+    def _getSchedules(self,**settings):
+        ''' the cells of each mote once the network is built, and the cache key of its schedule '''
+        context = self.createContext(3,numMotes=30,squareSide=3.0,**settings)
+        return (helpers.getMoteSchedules(context),context.scheduler._scheduleKey())
+
+    def test_cacheHitReproducesSchedule(self):
+        ''' the same network gets the same schedule from the cache as without it '''
+        (schedules,key) = self._getSchedules()
+        self._getSchedules(scheduleCache=True)
+        self.assertIn(key,Scheduler._scheduleCache)
+        self.assertEqual(self._getSchedules(scheduleCache=True),(schedules,key))
+
+    def test_cacheKeyHasPlacementInputs(self):
+        ''' networks whose schedules are placed differently do not share a cache entry '''
+        for (settings,otherSettings) in [
+                (dict(schedulingPolicy='demand'),dict(schedulingPolicy='tasa')),
+                (dict(schedulingPolicy='tasa',pkPeriod=1.0),dict(schedulingPolicy='tasa',pkPeriod=0.1)),
+            ]:
+            Scheduler._scheduleCache.clear()
+            (schedules,key) = self._getSchedules(**otherSettings)
+            self._getSchedules(scheduleCache=True,**settings)
+            self.assertFalse(key in Scheduler._scheduleCache)
+            self.assertEqual(self._getSchedules(scheduleCache=True,**otherSettings),(schedules,key))
+
+class TestReschedulingStats(helpers.SimulationTestCase):
+
+    def test_reschedulingsWrittenToOutputFile(self):
+        ''' each rescheduling is counted once in the statistics of the output file '''
+        context = self.createContext(3,numCyclesPerRun=12,schedulerUpdatePeriod=505)
+        context.run()
+
+        # the statistics lines are the column names and the lines of numbers
+        # between the topologies
+        with open(context.settings.getOutputFile()) as f:
+            lines       = [line.split() for line in f]
+        columnNames     = [line[1:] for line in lines if line[:1]==['#']][0]
+        stats           = [
+            dict(zip(columnNames,line)) for line in lines
+            if len(line)==len(columnNames) and all(v.replace('.','').isdigit() for v in line)
+        ]
+
+        updates         = context.scheduler.updates[:context.stats.numUpdatesWritten]
+        self.assertEqual(len(stats),12)
+        self.assertTrue(updates)
+        self.assertEqual(sum(int(s['numReschedulings']) for s in stats),len(updates))
+        self.assertEqual(sum(int(s['cellsAdded']) for s in stats),sum(u['cellsAdded'] for u in updates))
+        self.assertEqual(sum(int(s['cellsRemoved']) for s in stats),sum(u['cellsRemoved'] for u in updates))
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+'''
+\brief Tests of the 6top sublayer of the motes.
+'''
+
+#============================ imports =========================================
+
+import unittest
+
+import helpers
+
+#============================ body ============================================
+
+class TestSixtop(helpers.SimulationTestCase):
+
+    def _getTxCells(self,mote,parent):
+        return sorted((ts,cell['ch']) for (ts,cell) in mote.schedule.items() if cell['neighbor']==parent and cell['dir']==mote.DIR_TX)
+
+    def test_releasedCentralizedCellsAreReservedAgain(self):
+        ''' the cells of the centralized schedule 6top releases can be reserved again '''
+
+        context = self.createContext(3)
+        tree    = context.topology.getRoutingTree()
+
+        # a mote the parent of which holds cells of the centralized schedule for it
+        for mote in context.motes:
+            parent = tree.getParent(mote)
+            cells  = parent and sorted((ts,ch) for (ts,dir,id,ch) in parent.combinedCellList if id==mote.id and dir==mote.DIR_RX)
+            if cells:
+                break
+        self.assertTrue(cells)
+
+        mote._sixtop_cell_reservation_request(parent,len(cells))
+        self.assertEqual(self._getTxCells(mote,parent),cells)
+
+        mote._sixtop_cell_deletion_sender(parent,[ts for (ts,_) in cells])
+        self.assertEqual(self._getTxCells(mote,parent),[])
+
+        mote._sixtop_cell_reservation_request(parent,len(cells))
+        self.assertEqual(self._getTxCells(mote,parent),cells)
+
+if __name__=='__main__':
+    unittest.main()